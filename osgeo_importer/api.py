@@ -1,9 +1,12 @@
 import json
 import logging
+import os
+import zlib
 
 import celery
 from django.conf.urls import url
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from tastypie import http
 from tastypie.authentication import SessionAuthentication
 from tastypie.authorization import Authorization
@@ -15,7 +18,9 @@ from tastypie.resources import ModelResource
 from tastypie.utils import trailing_slash
 
 from .models import UploadedData, UploadLayer, UploadFile
-from .tasks import import_object
+from .tasks import import_object, inspect_upload
+from .validators import validate_extension, validate_upload
+from .views import ASYNC_INSPECTION, ImportHelper
 
 
 logger = logging.getLogger(__name__)
@@ -55,8 +60,52 @@ class UploadedLayerResource(ModelResource):
         return super(UploadedLayerResource, self).get_object_list(request).filter(upload__user=request.user.id)
 
     def clean_configuration_options(self, request, obj, configuration_options):
+        """
+        Resolves `reimport_from`, the id of a previously imported upload layer of the requesting user, to the
+        `reimportTo` typename used by the importer to only apply the changes of a new version of a data set, and
+        checks the requesting user may change the layer named by `appendTo`.
+
+        The importer writes to the tables named by `appendTo` and `reimportTo`, so they are never taken from the
+        client as is.
+        """
+        configuration_options.pop('reimportTo', None)
+        append_to = configuration_options.pop('appendTo', None)
+        reimport_from = configuration_options.get('reimport_from')
+
+        if append_to:
+            layer = self.get_layer(append_to)
+
+            if layer is None:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Unable to find the layer to append to.'))
+
+            configuration_options['appendTo'] = self.get_changeable_layer(request, layer).typename
+
+        if reimport_from:
+            previous = self.get_object_list(request).filter(id=reimport_from).first()
+
+            if previous is None or previous.layer is None:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Unable to find the layer to re-import.'))
+
+            configuration_options['reimportTo'] = self.get_changeable_layer(request, previous.layer).typename
+
         return configuration_options
 
+    def get_layer(self, typename):
+        """
+        Returns the published layer with the given typename, or None. There are no published layers without GeoNode.
+        """
+        return None
+
+    @staticmethod
+    def get_changeable_layer(request, layer):
+        """
+        Returns `layer` if the requesting user may change its data.
+        """
+        if not request.user.has_perm('change_layer_data', layer):
+            raise ImmediateHttpResponse(response=http.HttpForbidden('Not allowed to change the data of the layer.'))
+
+        return layer
+
     def import_layer(self, request, pk=None, **kwargs):
         """Imports a layer
         """
@@ -81,6 +130,10 @@ class UploadedLayerResource(ModelResource):
             self.clean_configuration_options(request, obj, configuration_options)
             obj.configuration_options = configuration_options
             obj.save()
+        elif isinstance(configuration_options, list):
+            for layer_options in configuration_options:
+                if isinstance(layer_options, dict):
+                    self.clean_configuration_options(request, obj, layer_options)
 
         if not configuration_options:
             raise ImmediateHttpResponse(response=http.HttpBadRequest('Configuration options missing.'))
@@ -182,9 +235,166 @@ class MultipartResource(object):
 
 
 class UploadedFileResource(MultipartResource, ModelResource):
+    """
+    API for uploading files.
+
+    Large files can be sent in chunks, so an interrupted upload resumes where it stopped:
+
+    - POST file-upload/chunked/ with {"name": ..., "size": ...} starts an upload and returns its id.
+    - PUT file-upload/chunked/<id>/?offset=<n> appends the request body, `offset` must be the number of bytes
+      received so far (a 409 response returns the current offset).
+    - GET file-upload/chunked/<id>/ returns the offset and the CRC-32 of the bytes received.
+    - POST file-upload/chunked/<id>/complete/, optionally with {"checksum": ..., "size": ...}, checks and inspects
+      the file (in the inspect_upload task with OSGEO_IMPORTER_ASYNC_INSPECTION). The size must be given when
+      starting or completing the upload.
+    """
+
+    # Bytes read from the request at once when writing a chunk.
+    read_size = 65536
 
     class Meta:
         queryset = UploadFile.objects.all()
         authentication = SessionAuthentication()
         allowed_methods = ['put']
         resource_name = 'file-upload'
+
+    @staticmethod
+    def partial_path(upload):
+        return os.path.join(upload.upload_dir, upload.name + '.part')
+
+    @staticmethod
+    def chunked_status(upload):
+        return {'id': upload.id, 'name': upload.name, 'state': upload.state, 'size': upload.size,
+                'offset': upload.offset, 'checksum': upload.checksum}
+
+    def get_chunked_upload(self, request, pk):
+        """
+        Returns the requesting user's chunked upload, locked until the end of the transaction.
+        """
+        try:
+            return UploadedData.objects.select_for_update().get(pk=pk, user=request.user,
+                                                                state=UploadedData.STATE_UPLOADING)
+        except UploadedData.DoesNotExist:
+            raise ImmediateHttpResponse(response=http.HttpNotFound())
+
+    def start_chunked_upload(self, request, **kwargs):
+        """
+        Starts an upload sent in chunks.
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+
+        options = json.loads(request.body or '{}')
+        name = os.path.basename(options.get('name') or '')
+        size = options.get('size')
+        max_length = UploadedData._meta.get_field('name').max_length
+
+        if not name or len(name) > max_length or not validate_extension(name):
+            raise ImmediateHttpResponse(response=http.HttpBadRequest('Filetype not supported.'))
+
+        if size is not None and (not isinstance(size, (int, long)) or size < 0):
+            raise ImmediateHttpResponse(response=http.HttpBadRequest('Invalid size.'))
+
+        upload = UploadedData.objects.create(user=request.user, name=name, state=UploadedData.STATE_UPLOADING,
+                                             size=size, offset=0, checksum='%08x' % zlib.crc32(''))
+        upload.upload_dir = ImportHelper.get_upload_dir(upload)
+        upload.save()
+        open(self.partial_path(upload), 'wb').close()
+
+        return self.create_response(request, self.chunked_status(upload), response_class=http.HttpCreated)
+
+    def upload_chunk(self, request, pk=None, **kwargs):
+        """
+        Returns the state of a chunked upload (GET) or appends a chunk to it (PUT).
+        """
+        self.method_check(request, allowed=['get', 'put'])
+        self.is_authenticated(request)
+
+        with transaction.atomic():
+            upload = self.get_chunked_upload(request, pk)
+
+            if request.method == 'GET':
+                return self.create_response(request, self.chunked_status(upload))
+
+            if request.GET.get('offset') != str(upload.offset):
+                return self.create_response(request, self.chunked_status(upload), response_class=http.HttpConflict)
+
+            checksum = int(upload.checksum, 16)
+            offset = upload.offset
+
+            with open(self.partial_path(upload), 'r+b') as partial:
+                # Drop the bytes of a chunk that was interrupted before it was recorded.
+                partial.truncate(offset)
+                partial.seek(offset)
+
+                for data in iter(lambda: request.read(self.read_size), ''):
+                    partial.write(data)
+                    checksum = zlib.crc32(data, checksum)
+                    offset += len(data)
+
+            if upload.size is not None and offset > upload.size:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Chunk exceeds the size of the upload.'))
+
+            upload.offset = offset
+            upload.checksum = '%08x' % (checksum & 0xffffffff)
+            upload.save()
+
+        return self.create_response(request, self.chunked_status(upload))
+
+    def complete_chunked_upload(self, request, pk=None, **kwargs):
+        """
+        Checks the size and checksum of a chunked upload, then inspects the file like FileAddView does.
+        """
+        self.method_check(request, allowed=['post'])
+        self.is_authenticated(request)
+
+        with transaction.atomic():
+            upload = self.get_chunked_upload(request, pk)
+            options = json.loads(request.body or '{}')
+            size = options.get('size', upload.size)
+
+            if size is None:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Size of the upload missing.'))
+
+            if upload.offset != size:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest(
+                    'Upload is incomplete, {0} of {1} bytes received.'.format(upload.offset, size)))
+
+            if options.get('checksum') and options['checksum'].lower() != upload.checksum:
+                raise ImmediateHttpResponse(response=http.HttpBadRequest('Checksum mismatch.'))
+
+            path = os.path.join(upload.upload_dir, upload.name)
+            os.rename(self.partial_path(upload), path)
+
+            # The upload can't be written to or completed again once the lock is released.
+            upload.size = size
+            upload.state = UploadedData.STATE_UPLOADED
+            upload.save()
+
+        # Inspect outside of the transaction, so the upload isn't locked meanwhile and the tasks queued by the
+        # inspection (i.e. count_features) find the rows it creates.
+        if not validate_upload(path):
+            upload.state = UploadedData.STATE_INVALID
+            upload.save()
+            return http.HttpBadRequest('Inspector could not read file {} or file is empty'.format(upload.name))
+
+        ImportHelper().create_upload_files(upload, [path], inspect=not ASYNC_INSPECTION)
+
+        if ASYNC_INSPECTION:
+            inspect_upload.delay(upload.id)
+            return self.create_response(request, {'state': upload.state, 'id': upload.id},
+                                        response_class=http.HttpAccepted)
+
+        return self.create_response(request, {'state': upload.state, 'id': upload.id,
+                                              'count': UploadFile.objects.filter(upload=upload.id).count()})
+
+    def prepend_urls(self):
+        return [url(r"^(?P<resource_name>{0})/chunked{1}$".format(self._meta.resource_name, trailing_slash()),
+                    self.wrap_view('start_chunked_upload'), name="importer_chunked_upload"),
+                url(r"^(?P<resource_name>{0})/chunked/(?P<pk>\d+){1}$".format(self._meta.resource_name,
+                                                                              trailing_slash()),
+                    self.wrap_view('upload_chunk'), name="importer_upload_chunk"),
+                url(r"^(?P<resource_name>{0})/chunked/(?P<pk>\d+)/complete{1}$".format(self._meta.resource_name,
+                                                                                       trailing_slash()),
+                    self.wrap_view('complete_chunked_upload'), name="importer_complete_chunked_upload"),
+                ]
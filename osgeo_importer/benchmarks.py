@@ -0,0 +1,388 @@
+"""
+Benchmarks for the importer.
+
+Benchmarks need the same environment as the test suite (a configured OSGEO_DATASTORE) and are run with the
+importer_benchmark management command, e.g. ``python manage.py importer_benchmark writers --count 1000000``.
+Results are printed as JSON, ``--output`` writes them to a file so runs can be diffed.
+"""
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import gdal
+import ogr
+import osr
+from django import db
+from django.conf import settings
+
+from .importers import OGRImport
+from .inspectors import BigDateOGRFieldConverter, GDALInspector, OGRFieldConverter, PostGISFieldConverter
+from .utils import quote_ident, raster_import
+
+logger = logging.getLogger(__name__)
+
+WRITERS = ['osgeo_importer.writers.OGRFeatureWriter', 'osgeo_importer.writers.PostGISCopyWriter']
+
+
+FIELD_TYPES = {
+    'integer': (ogr.OFTInteger, lambda i: i),
+    'real': (ogr.OFTReal, lambda i: i / 7.0),
+    'string': (ogr.OFTString, lambda i: 'feature {0}'.format(i)),
+    'date': (ogr.OFTString, lambda i: '{0:04d}-{1:02d}-{2:02d}'.format(1900 + i % 100, 1 + i % 12, 1 + i % 28)),
+}
+
+DEFAULT_FIELDS = [('id', 'integer'), ('value', 'real'), ('name', 'string'), ('date', 'date')]
+
+GEOMETRY_TYPES = {
+    'point': (ogr.wkbPoint, 'POINT ({0} {1})'),
+    'line': (ogr.wkbLineString, 'LINESTRING ({0} {1}, {2} {3}, {2} {1})'),
+    'polygon': (ogr.wkbPolygon, 'POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'),
+}
+
+# Driver name, file extension and layer creation options of the vector formats synthetic layers are written as.
+FORMATS = {
+    'shp': ('ESRI Shapefile', 'shp', []),
+    'csv': ('CSV', 'csv', ['GEOMETRY=AS_WKT']),
+    'geojson': ('GeoJSON', 'geojson', []),
+    'gpkg': ('GPKG', 'gpkg', []),
+    'kml': ('KML', 'kml', []),
+}
+
+
+def parse_fields(fields):
+    """
+    Parses a field mix given as a comma separated list of field types, e.g. ``integer,string,date,date``, into a
+    list of (name, field type) tuples.
+    """
+    if not fields:
+        return DEFAULT_FIELDS
+
+    if not isinstance(fields, basestring):
+        return fields
+
+    kinds = [kind.strip() for kind in fields.split(',') if kind.strip()]
+
+    for kind in kinds:
+        if kind not in FIELD_TYPES:
+            raise ValueError('Unknown field type: {0}'.format(kind))
+
+    return [('{0}_{1}'.format(kind, i), kind) for i, kind in enumerate(kinds)]
+
+
+def generate_layer(path, count, geometry_type='point', driver_name='ESRI Shapefile', options=None, fields=None):
+    """
+    Writes `count` synthetic features to `path`.
+
+    :param geometry_type: One of GEOMETRY_TYPES.
+    :param options: Layer creation options passed to the driver.
+    :param fields: A list of (name, field type) tuples where the field type is one of FIELD_TYPES, defaults to
+    DEFAULT_FIELDS.
+    """
+    ogr_type, wkt = GEOMETRY_TYPES[geometry_type]
+    fields = parse_fields(fields)
+    driver = ogr.GetDriverByName(driver_name)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+
+    data_source = driver.CreateDataSource(path)
+    layer = data_source.CreateLayer(os.path.splitext(os.path.basename(path))[0], srs, ogr_type,
+                                    options=options or [])
+
+    for name, kind in fields:
+        layer.CreateField(ogr.FieldDefn(name, FIELD_TYPES[kind][0]))
+
+    transactions = layer.TestCapability(ogr.OLCTransactions)
+
+    if transactions:
+        layer.StartTransaction()
+
+    for i in range(count):
+        feature = ogr.Feature(layer.GetLayerDefn())
+
+        for name, kind in fields:
+            feature.SetField(name, FIELD_TYPES[kind][1](i))
+
+        x, y = -180 + (i % 3600) / 10.0, -90 + (i % 1800) / 10.0
+        feature.SetGeometry(ogr.CreateGeometryFromWkt(wkt.format(x, y, x + 0.05, y + 0.05)))
+        layer.CreateFeature(feature)
+        feature = None
+
+    if transactions:
+        layer.CommitTransaction()
+
+    data_source = None
+    return path
+
+
+def generate_points(path, count, driver_name='ESRI Shapefile', options=None):
+    """
+    Writes `count` synthetic points with integer, real, string and date fields to `path`.
+    """
+    return generate_layer(path, count, 'point', driver_name, options)
+
+
+def generate_raster(path, size=1024, bands=3):
+    """
+    Writes a synthetic `size` x `size` pixel GeoTIFF covering the world in EPSG:4326.
+    """
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+
+    data = gdal.GetDriverByName('GTiff').Create(path, size, size, bands, gdal.GDT_Byte)
+    data.SetGeoTransform([-180, 360.0 / size, 0, 90, 0, -180.0 / size])
+    data.SetProjection(srs.ExportToWkt())
+
+    gradient = bytearray(range(256)) * (size // 256 + 2)
+
+    for band in range(1, bands + 1):
+        raster_band = data.GetRasterBand(band)
+
+        for row in range(size):
+            offset = (row * band) % 256
+            raster_band.WriteRaster(0, row, size, 1, str(gradient[offset:offset + size]))
+
+    data = None
+    return path
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size, in kilobytes, of this process and of its terminated children (i.e. import
+    workers).
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss +
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def measure(stages, stage, features, func, *args, **kwargs):
+    """
+    Calls `func` and records its duration, throughput and the peak RSS after it ran in `stages[stage]`.
+
+    :return: The result of `func`.
+    """
+    start = time.time()
+    result = func(*args, **kwargs)
+    seconds = time.time() - start
+
+    stages[stage] = {'seconds': seconds,
+                     'features_per_second': features / seconds if features and seconds else None,
+                     'peak_rss_kb': peak_rss()}
+    return result
+
+
+def drop_layer(name):
+    """
+    Drops a table created by a benchmark from the target datastore.
+    """
+    cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+    cursor.execute('DROP TABLE IF EXISTS {0} CASCADE'.format(quote_ident(name)))
+
+
+def copy_layer(name, copy_name):
+    """
+    Copies a table created by a benchmark, so stages that change it each start from the same table.
+    """
+    cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+    cursor.execute('CREATE TABLE {1} (LIKE {0} INCLUDING ALL)'.format(quote_ident(name), quote_ident(copy_name)))
+    cursor.execute('INSERT INTO {1} SELECT * FROM {0}'.format(quote_ident(name), quote_ident(copy_name)))
+
+
+def count_features(name):
+    cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+    cursor.execute('SELECT count(*) FROM {0}'.format(quote_ident(name)))
+    return cursor.fetchone()[0]
+
+
+def time_import(path, configuration_options=None, importer=OGRImport, drop=True, **attributes):
+    """
+    Imports `path` into the target datastore (without running any import handlers) and returns the number of
+    features imported and the throughput.
+
+    :param drop: Drops the imported tables, otherwise the [layername, layer_options] of the imported layers are
+    returned in `layers`.
+    :param attributes: Importer attributes to override, e.g. writer or workers.
+    """
+    if configuration_options is None:
+        configuration_options = [{'index': 0}]
+
+    gi = importer(path)
+
+    for name, value in attributes.items():
+        setattr(gi, name, value)
+
+    start = time.time()
+    layers = gi.import_file(configuration_options=configuration_options)
+    seconds = time.time() - start
+
+    features = 0
+    for layer, _ in layers:
+        features += count_features(layer)
+
+        if drop:
+            drop_layer(layer)
+
+    results = {'features': features, 'seconds': seconds,
+               'features_per_second': features / seconds if seconds else None}
+
+    if not drop:
+        results['layers'] = layers
+
+    return results
+
+
+def describe(path):
+    with GDALInspector(path) as inspector:
+        return inspector.describe_fields()
+
+
+def convert(converter, target_store, layer, field):
+    with converter(target_store) as datasource:
+        return datasource.convert_field(layer, field)
+
+
+def benchmark_vector(path, count, fields=None):
+    """
+    Times the stages of importing a vector file: describing its fields, importing it and converting its first
+    date field with each field converter, each converting a fresh copy of the imported layer.
+    """
+    stages = {}
+    date_fields = [name for name, kind in parse_fields(fields) if kind == 'date']
+
+    measure(stages, 'describe_fields', count, describe, path)
+    imported = measure(stages, 'import_file', count, time_import, path, drop=False)
+    layer, layer_options = imported['layers'][0]
+    target_store = OGRImport(path).target_store
+
+    try:
+        if date_fields:
+            field = layer_options.get('modified_fields', {}).get(date_fields[0], date_fields[0])
+
+            for name, converter in (('convert_field', OGRFieldConverter),
+                                    ('convert_field_postgis', PostGISFieldConverter),
+                                    ('convert_field_bigdate', BigDateOGRFieldConverter)):
+                copy_name = '{0}_{1}'.format(layer, name)
+                copy_layer(layer, copy_name)
+
+                try:
+                    measure(stages, name, count, convert, converter, target_store, copy_name, field)
+                finally:
+                    drop_layer(copy_name)
+    finally:
+        drop_layer(layer)
+
+    stages['import_file']['features'] = imported['features']
+    return stages
+
+
+def benchmark_formats(count=100000, **kwargs):
+    """
+    Generates point, line and polygon layers of `count` features in every format of FORMATS (or the comma separated
+    `formats`) and times each stage of their import, see `benchmark_vector`. A synthetic GeoTIFF is described and
+    imported with `raster_import`.
+
+    :param fields: The field mix of the generated layers, see `parse_fields`.
+    :param geometry_types: A comma separated list of GEOMETRY_TYPES to generate.
+    """
+    fields = kwargs.get('fields')
+    formats = (kwargs.get('formats') or ','.join(sorted(FORMATS))).split(',')
+    geometry_types = (kwargs.get('geometry_types') or ','.join(sorted(GEOMETRY_TYPES))).split(',')
+    workdir = tempfile.mkdtemp()
+    results = {}
+
+    try:
+        for geometry_type in geometry_types:
+            for file_format in formats:
+                driver_name, extension, options = FORMATS[file_format]
+                path = os.path.join(workdir, '{0}_{1}.{2}'.format(geometry_type, file_format, extension))
+                stages = {}
+                measure(stages, 'generate', count, generate_layer, path, count, geometry_type, driver_name, options,
+                        fields)
+                stages.update(benchmark_vector(path, count, fields))
+                results['{0}.{1}'.format(geometry_type, file_format)] = stages
+
+        size = kwargs.get('raster_size', 2048)
+        path = generate_raster(os.path.join(workdir, 'raster.tif'), size)
+        stages = {}
+        measure(stages, 'describe_fields', None, describe, path)
+        measure(stages, 'raster_import', None, raster_import, path, os.path.join(workdir, 'raster_import.tif'))
+        stages['raster_import']['pixels_per_second'] = (size * size / stages['raster_import']['seconds']
+                                                        if stages['raster_import']['seconds'] else None)
+        results['raster.tif'] = stages
+    finally:
+        shutil.rmtree(workdir)
+
+    results['peak_rss_kb'] = peak_rss()
+    return results
+
+
+def benchmark_writers(count=1000000, **kwargs):
+    """
+    Compares the throughput of the OGR and COPY writers on a synthetic point layer.
+    """
+    workdir = tempfile.mkdtemp()
+
+    try:
+        path = generate_points(os.path.join(workdir, 'points.shp'), count)
+        results = dict((writer, time_import(path, writer=writer)) for writer in WRITERS)
+    finally:
+        shutil.rmtree(workdir)
+
+    baseline, copy = [results[writer]['features_per_second'] for writer in WRITERS]
+    results['speedup'] = copy / baseline if baseline else None
+    return results
+
+
+def benchmark_csv_scaling(count=500000, **kwargs):
+    """
+    Imports CSV files of `count` / 10 and `count` points and compares the time spent per feature.
+
+    Reading CSV features by FID is O(n), so an import that does not read features sequentially scales
+    quadratically. The import is considered linear when the time per feature of the large file stays within
+    `tolerance` times that of the small one.
+    """
+    tolerance = kwargs.get('tolerance', 2.0)
+    workdir = tempfile.mkdtemp()
+    results = {}
+
+    try:
+        for size in (count / 10, count):
+            path = generate_points(os.path.join(workdir, 'points_{0}.csv'.format(size)), size, 'CSV',
+                                   options=['GEOMETRY=AS_XY'])
+            results[size] = time_import(path)
+    finally:
+        shutil.rmtree(workdir)
+
+    small, large = [results[size] for size in sorted(results)]
+    scaling = (large['seconds'] / large['features']) / (small['seconds'] / small['features'])
+    return {'imports': results, 'scaling': scaling, 'linear': scaling <= tolerance}
+
+
+def benchmark_workers(count=1000000, **kwargs):
+    """
+    Imports a single synthetic point layer, split in chunks, with an increasing number of workers.
+    """
+    workers = kwargs.get('workers', (1, 2, 4))
+    workdir = tempfile.mkdtemp()
+
+    try:
+        path = generate_points(os.path.join(workdir, 'points.shp'), count)
+        results = dict((n, time_import(path, workers=n, chunk_size=max(count / (n * 4), 1))) for n in workers)
+    finally:
+        shutil.rmtree(workdir)
+
+    baseline = results[min(workers)]['seconds']
+    for n in workers:
+        results[n]['speedup'] = baseline / results[n]['seconds'] if results[n]['seconds'] else None
+
+    return results
+
+
+BENCHMARKS = {
+    'writers': benchmark_writers,
+    'csv_scaling': benchmark_csv_scaling,
+    'workers': benchmark_workers,
+    'formats': benchmark_formats,
+}
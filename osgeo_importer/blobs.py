@@ -0,0 +1,99 @@
+"""
+A content addressed store for uploaded files.
+
+Blobs are named by the SHA-256 of their content and the files of uploads are hard links to them, so a file that is
+uploaded again doesn't use more disk space. A blob is removed once no UploadFile references its hash and no file
+links to it.
+"""
+import errno
+import hashlib
+import logging
+import os
+
+from .importers import BLOB_DIR
+from .models import UploadFile
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(path, block_size=1048576):
+    """
+    Returns the hex SHA-256 of a file's content.
+    """
+    digest = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), ''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def blob_path(digest):
+    return os.path.join(BLOB_DIR, digest[:2], digest)
+
+
+def store(path):
+    """
+    Adds a file to the store, replacing it by a hard link to the existing blob if its content was stored before.
+
+    :return: The content hash of the file, or None if it can't be linked to the store (i.e. on another file system).
+    """
+    digest = content_hash(path)
+    blob = blob_path(digest)
+
+    try:
+        os.makedirs(os.path.dirname(blob))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    while True:
+        try:
+            os.link(path, blob)
+            return digest
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                logger.warning('Unable to store {0} as a blob: {1}'.format(path, e))
+                return
+
+        link = path + '.blob'
+
+        try:
+            if os.path.samefile(path, blob):
+                return digest
+
+            os.link(blob, link)
+        except OSError as e:
+            # The blob was released in the meantime, store the file as a new blob.
+            if e.errno == errno.ENOENT:
+                continue
+            raise
+
+        os.rename(link, path)
+        return digest
+
+
+def release(digest):
+    """
+    Removes a blob that is no longer referenced by an UploadFile nor linked from an upload directory.
+
+    :return: True if the blob was removed.
+    """
+    blob = blob_path(digest)
+
+    if not os.path.exists(blob) or os.stat(blob).st_nlink > 1:
+        return False
+
+    if UploadFile.objects.filter(content_hash=digest).exists():
+        return False
+
+    try:
+        os.remove(blob)
+    except OSError as e:
+        # Released by another process.
+        if e.errno != errno.ENOENT:
+            raise
+        return False
+
+    return True
@@ -1,13 +1,95 @@
 import os
 from django import forms
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
 from .models import UploadFile
-from .validators import validate_extension, validate_inspector_can_read, validate_shapefiles_have_all_parts
+from .validators import validate_extension, validate_shapefiles_have_all_parts, validate_upload
+from multiprocessing.pool import ThreadPool
 from zipfile import is_zipfile, ZipFile
 import tempfile
 import logging
 import shutil
 logger = logging.getLogger(__name__)
 
+# Keep uploaded zips that only hold shapefiles as they are, GDAL reads them through /vsizip/. Otherwise the files of
+# zips are extracted into the upload directory.
+READ_ZIPS_IN_PLACE = getattr(settings, 'OSGEO_IMPORTER_READ_ZIPS_IN_PLACE', False)
+
+# Number of uploaded files validated at once, GDAL releases the GIL while reading them.
+VALIDATION_THREADS = getattr(settings, 'OSGEO_IMPORTER_VALIDATION_THREADS', 4)
+
+SHAPEFILE_EXTENSIONS = ['shp', 'shx', 'dbf', 'prj', 'cpg']
+
+
+class ZipMember(object):
+    """
+    A file of an uploaded zip, validated through /vsizip/ and extracted once its upload directory is known.
+    """
+
+    def __init__(self, archive, member):
+        self.archive = archive
+        self.member = member
+        self.name = '/vsizip/{0}/{1}'.format(archive, member)
+
+    def extract(self, outdir):
+        """
+        Extracts the file into `outdir` and returns its path.
+        """
+        path = os.path.join(outdir, os.path.basename(self.member))
+
+        with ZipFile(self.archive) as zip:
+            with zip.open(self.member) as source:
+                with open(path, 'wb') as outfile:
+                    shutil.copyfileobj(source, outfile)
+
+        return path
+
+
+def save_upload(file, outputdir):
+    """
+    Moves an uploaded file to `outputdir`, or writes it there when it is only held in memory.
+    """
+    path = os.path.join(outputdir, os.path.basename(file.name))
+
+    if hasattr(file, 'temporary_file_path'):
+        file_move_safe(file.temporary_file_path(), path)
+    else:
+        with open(path, 'wb') as outfile:
+            for chunk in file.chunks():
+                outfile.write(chunk)
+
+    return path
+
+
+def readable_in_place(members):
+    """
+    Returns True if the files of a zip are shapefiles at its root, which GDAL reads without extracting them.
+    """
+    extensions = [os.path.splitext(member)[1].lstrip('.').lower() for member in members]
+
+    return ('shp' in extensions and all(extension in SHAPEFILE_EXTENSIONS for extension in extensions) and
+            not any('/' in member for member in members))
+
+
+def validate_files(paths, threads=None):
+    """
+    Returns whether each file is valid (see validate_upload), validating up to `threads` (VALIDATION_THREADS) files
+    at once.
+    """
+    threads = min(threads or VALIDATION_THREADS, len(paths))
+
+    if threads <= 1:
+        return [validate_upload(path) for path in paths]
+
+    pool = ThreadPool(threads)
+
+    try:
+        return pool.map(validate_upload, paths)
+    finally:
+        pool.close()
+        pool.join()
+
 
 class UploadFileForm(forms.Form):
     file = forms.FileField(widget=forms.ClearableFileInput(attrs={'multiple': True}))
@@ -21,50 +103,48 @@ class UploadFileForm(forms.Form):
         outputdir = tempfile.mkdtemp()
         files = self.files.getlist('file')
         validfiles = []
+        archives = {}
 
-        # Create list of all potentially valid files, exploding first level zip files
+        # Create list of all potentially valid files, listing the files of first level zip files
         for file in files:
             if not validate_extension(file.name):
                 self.add_error('file', 'Filetype not supported.')
                 continue
 
             if is_zipfile(file):
+                archives[file.name] = []
                 with ZipFile(file) as zip:
                     for zipname in zip.namelist():
                         if not validate_extension(zipname):
                             self.add_error('file', 'Filetype in zip not supported.')
                             continue
                         validfiles.append(zipname)
+                        archives[file.name].append(zipname)
             else:
                 validfiles.append(file.name)
         # Make sure shapefiles have all their parts
         if not validate_shapefiles_have_all_parts(validfiles):
             self.add_error('file', 'Shapefiles must include .shp,.dbf,.shx,.prj')
-        # Unpack all zip files and create list of cleaned file objects
+        # Move uploaded files in place once, the files of zips are read through /vsizip/ and extracted by the view
         cleaned_files = []
         for file in files:
             if file.name in validfiles:
-                with open(os.path.join(outputdir, file.name), 'w') as outfile:
-                    for chunk in file.chunks():
-                        outfile.write(chunk)
-                cleaned_files.append(outfile)
-            elif is_zipfile(file):
-                with ZipFile(file) as zip:
-                    for zipfile in zip.namelist():
-                        if zipfile in validfiles:
-                            with zip.open(zipfile) as f:
-                                with open(os.path.join(outputdir, zipfile), 'w') as outfile:
-                                    shutil.copyfileobj(f, outfile)
-                                    cleaned_files.append(outfile)
+                cleaned_files.append(File(None, save_upload(file, outputdir)))
+            elif file.name in archives:
+                archive = save_upload(file, outputdir)
+                if READ_ZIPS_IN_PLACE and readable_in_place(archives[file.name]):
+                    cleaned_files.append(File(None, archive))
+                else:
+                    cleaned_files.extend(ZipMember(archive, member) for member in archives[file.name])
 
         # After moving files in place make sure they can be opened by inspector
+        readable = validate_files([cleaned_file.name for cleaned_file in cleaned_files])
         inspected_files = []
-        for cleaned_file in cleaned_files:
-            cleaned_file_path = os.path.join(outputdir, cleaned_file.name)
-            if not validate_inspector_can_read(cleaned_file_path):
+        for cleaned_file, can_read in zip(cleaned_files, readable):
+            if not can_read:
                 self.add_error(
                     'file',
-                    'Inspector could not read file {} or file is empty'.format(cleaned_file_path)
+                    'Inspector could not read file {} or file is empty'.format(cleaned_file.name)
                 )
                 continue
             inspected_files.append(cleaned_file)
@@ -9,6 +9,7 @@ from .api import (  # noqa: F401
 )
 from geonode.api.api import ProfileResource
 from geonode.geoserver.helpers import ogc_server_settings
+from geonode.layers.models import Layer
 from tastypie.fields import ForeignKey
 
 
@@ -22,6 +23,8 @@ class UploadedDataResource(UploadedDataResource):  # noqa
 
 class UploadedLayerResource(UploadedLayerResource):  # noqa
     def clean_configuration_options(self, request, obj, configuration_options):
+        configuration_options = super(UploadedLayerResource, self).clean_configuration_options(
+            request, obj, configuration_options)
 
         if configuration_options.get('geoserver_store'):
             store = configuration_options.get('geoserver_store')
@@ -36,3 +39,6 @@ class UploadedLayerResource(UploadedLayerResource):  # noqa
             configuration_options['layer_owner'] = obj.upload.user.username
 
         return configuration_options
+
+    def get_layer(self, typename):
+        return Layer.objects.filter(typename=typename).first()
@@ -1,7 +1,8 @@
 import logging
 from django import db
 from django.conf import settings
-from osgeo_importer.inspectors import OGRFieldConverter, BigDateOGRFieldConverter
+from osgeo_importer.inspectors import BigDateOGRFieldConverter, PostGISFieldConverter
+from osgeo_importer.utils import datastore_connection_string, quote_ident
 
 
 DEFAULT_IMPORT_HANDLERS = []
@@ -22,10 +23,21 @@ def ensure_can_run(func):
     return func_wrapper
 
 
+def merges_into_layer(layer_config):
+    """
+    Returns True if the features of a layer are appended or re-imported into an existing, published, layer.
+    """
+    return 'appendTo' in layer_config or 'reimportTo' in layer_config
+
+
 class ImportHandlerMixin(object):
     """
     A mixin providing the basic layout for handlers.
     """
+
+    # Handlers that modify the data of a layer run before the importer finalizes the layer.
+    modifies_data = False
+
     def __init__(self, importer, *args, **kwargs):
         self.importer = importer
 
@@ -69,38 +81,78 @@ class FieldConverterHandler(GetModifiedFieldsMixin, ImportHandlerMixin):
     """
     Converts fields based on the layer_configuration.
     """
-    field_converter = OGRFieldConverter
+    field_converter = PostGISFieldConverter
+    modifies_data = True
 
     def convert_field_to_time(self, layer, field):
-        d = db.connections[settings.OSGEO_DATASTORE].settings_dict
-        connection_string = "PG:dbname='%s' user='%s' password='%s' host='%s' port='%s'" % (d['NAME'], d['USER'],
-                                                                                            d['PASSWORD'], d['HOST'],
-                                                                                            d['PORT'])
+        return self.convert_fields_to_time(layer, [field])[field]
 
-        with self.field_converter(connection_string) as datasource:
-            return datasource.convert_field(layer, field)
+    def convert_fields_to_time(self, layer, fields):
+        """
+        Converts all fields with a single field converter, which adds the new columns and fills them at once.
+
+        :return: A dict of the converted fields and their new column names.
+        """
+        with self.field_converter(datastore_connection_string()) as datasource:
+            return datasource.convert_fields(layer, fields)
+
+    @staticmethod
+    def get_columns(layer):
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('SELECT column_name FROM information_schema.columns WHERE table_name = %s', (layer,))
+        return set(row[0] for row in cursor.fetchall())
+
+    @staticmethod
+    def drop_columns(layer, columns):
+        if not columns:
+            return
+
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('ALTER TABLE {0} {1}'.format(quote_ident(layer), ', '.join(
+            'DROP COLUMN {0}'.format(quote_ident(column)) for column in sorted(columns))))
 
     @ensure_can_run
     def handle(self, layer, layer_config, *args, **kwargs):
+        """
+        Fields listed in `converted_fields` were converted with this handler's field converter by the importer
+        while the layer was loaded.
+        """
         self.update_date_attributes(layer_config)
+        converter = '{0}.{1}'.format(self.field_converter.__module__, self.field_converter.__name__)
+        converted = {}
 
-        try:
-            for field_to_convert in set(layer_config.get('convert_to_date', [])):
+        if layer_config.get('stream_columns', {}).get('converter') == converter:
+            converted.update(layer_config.get('converted_fields', {}))
 
-                if not field_to_convert:
-                    continue
+        fields_to_convert = [field for field in set(layer_config.get('convert_to_date', []))
+                             if field and field not in converted]
 
-                new_col = self.convert_field_to_time(layer, field_to_convert)
+        columns = self.get_columns(layer) if fields_to_convert else None
 
-                # if the start_date or end_date needed to be converted to a date
-                # field, use the newly created field name/
-                for date_option in ('start_date', 'end_date'):
-                    if layer_config.get(date_option) == field_to_convert:
-                        layer_config[date_option] = new_col.lower()
+        try:
+            if fields_to_convert:
+                converted.update(self.convert_fields_to_time(layer, fields_to_convert))
 
         except Exception:
             logging.exception(
-                "Error while converting value {!r}".format(field_to_convert))
+                "Error while converting values {!r}".format(fields_to_convert))
+
+            # Drop the columns added before the failure, then convert the fields one at a time, so a field that
+            # fails doesn't block the others.
+            self.drop_columns(layer, self.get_columns(layer) - columns)
+
+            for field_to_convert in fields_to_convert:
+                try:
+                    converted[field_to_convert] = self.convert_field_to_time(layer, field_to_convert)
+                except Exception:
+                    logging.exception(
+                        "Error while converting value {!r}".format(field_to_convert))
+
+        # if the start_date or end_date needed to be converted to a date
+        # field, use the newly created field name/
+        for date_option in ('start_date', 'end_date'):
+            if layer_config.get(date_option) in converted:
+                layer_config[date_option] = converted[layer_config[date_option]].lower()
 
 
 class BigDateFieldConverterHandler(FieldConverterHandler):
@@ -112,3 +164,47 @@ class BigDateFieldConverterHandler(FieldConverterHandler):
     """
 
     field_converter = BigDateOGRFieldConverter
+
+
+class IndexHandler(GetModifiedFieldsMixin, ImportHandlerMixin):
+    """
+    Creates attribute indexes on a layer's start_date, end_date and index_fields columns, then refreshes the table
+    statistics so the first queries made by GeoServer get good plans.
+
+    Note: This handler should run after the handlers that add or convert columns (ie FieldConverterHandler).
+    """
+    modifies_data = True
+
+    def can_run(self, layer, layer_config, *args, **kwargs):
+        """
+        Only run this handler for vector layers that are not merged into an existing, already indexed, layer.
+        """
+        return not layer_config.get('raster') and not merges_into_layer(layer_config)
+
+    def get_columns(self, layer):
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('SELECT column_name FROM information_schema.columns WHERE table_name = %s', (layer,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @ensure_can_run
+    def handle(self, layer, layer_config, *args, **kwargs):
+        """
+        Handler specific params:
+        "index_fields": A list of additional fields to index.
+        """
+        self.update_date_attributes(layer_config)
+        modified_fields = layer_config.get('modified_fields', {})
+        fields = [layer_config.get('start_date'), layer_config.get('end_date')]
+        fields.extend(modified_fields.get(field, field) for field in layer_config.get('index_fields', []))
+
+        columns = self.get_columns(layer)
+        indexed = []
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+
+        for field in fields:
+            if field and field in columns and field not in indexed:
+                cursor.execute('CREATE INDEX ON {0} ({1})'.format(quote_ident(layer), quote_ident(field)))
+                indexed.append(field)
+
+        cursor.execute('ANALYZE {0}'.format(quote_ident(layer)))
+        return indexed
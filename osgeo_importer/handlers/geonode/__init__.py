@@ -1,7 +1,7 @@
 from geonode.layers.models import Layer
 from osgeo_importer.models import UploadLayer
 from osgeo_importer.handlers import ImportHandlerMixin
-from osgeo_importer.handlers import ensure_can_run
+from osgeo_importer.handlers import ensure_can_run, merges_into_layer
 from osgeo_importer.importers import UPLOAD_DIR
 from geonode.geoserver.helpers import gs_slurp
 from geonode.layers.metadata import set_metadata
@@ -48,6 +48,9 @@ class GeoNodePublishHandler(ImportHandlerMixin):
         Handler specific params:
         "layer_owner": Sets the owner of the layer.
         """
+        if layer_config.get('reimportTo'):
+            return self.link_reimported_layer(layer, layer_config)
+
         owner = layer_config.get('layer_owner')
         if isinstance(owner, str) or isinstance(owner, unicode):
             owner = User.objects.filter(username=owner).first()
@@ -74,6 +77,20 @@ class GeoNodePublishHandler(ImportHandlerMixin):
 
         return results
 
+    def link_reimported_layer(self, layer, layer_config):
+        """
+        Points the upload layer of a re-import at the GeoNode layer that was updated.
+        """
+        if not self.importer.upload_file:
+            return
+
+        matched_layer = Layer.objects.get(name=layer)
+        upload_layer = UploadLayer.objects.get(upload_file=self.importer.upload_file.pk,
+                                               index=layer_config.get('index'))
+        upload_layer.layer = matched_layer
+        upload_layer.save()
+        return {'layers': [{'name': matched_layer.name, 'status': 'updated'}]}
+
 
 class GeoNodeMetadataHandler(ImportHandlerMixin):
     """Import uploaded XML
@@ -81,9 +98,10 @@ class GeoNodeMetadataHandler(ImportHandlerMixin):
 
     def can_run(self, layer, layer_config, *args, **kwargs):
         """
-        Only run this handler if the layer is found in Geoserver and the layer's style is the generic style.
+        Only run this handler if the layer is found in Geoserver and the layer's style is the generic style. The
+        metadata of layers that are appended to or re-imported is left as is.
         """
-        if not layer_config.get('metadata', None):
+        if not layer_config.get('metadata', None) or merges_into_layer(layer_config):
             return False
 
         return True
@@ -1,10 +1,11 @@
 import os
 import logging
+import osr
 import requests
 from decimal import Decimal, InvalidOperation
 from django import db
 from django.conf import settings
-from osgeo_importer.handlers import ImportHandlerMixin, GetModifiedFieldsMixin, ensure_can_run
+from osgeo_importer.handlers import ImportHandlerMixin, GetModifiedFieldsMixin, ensure_can_run, merges_into_layer
 from osgeo_importer.importers import UPLOAD_DIR
 from geoserver.catalog import FailedRequestError, ConflictingDataError
 from geonode.geoserver.helpers import gs_catalog
@@ -39,10 +40,11 @@ class GeoServerTimeHandler(GetModifiedFieldsMixin, GeoserverHandlerMixin):
 
     def can_run(self, layer, layer_config, *args, **kwargs):
         """
-        Returns true if the configuration has enough information to run the handler.
+        Returns true if the configuration has enough information to run the handler. The time dimension of layers
+        that are appended to or re-imported is left as is.
         """
 
-        if not layer_config.get('configureTime', None):
+        if not layer_config.get('configureTime', None) or merges_into_layer(layer_config):
             return False
 
         if not any([layer_config.get('start_date', None), layer_config.get('end_date', None)]):
@@ -77,7 +79,9 @@ class GeoserverPublishHandler(GeoserverHandlerMixin):
         """
         if layer_config.get('raster'):
             return False
-        return True
+
+        # Appended and re-imported features are published through the existing layer.
+        return not merges_into_layer(layer_config)
 
     def get_default_store(self):
         connection = db.connections[settings.OSGEO_DATASTORE]
@@ -236,8 +240,11 @@ class GeoWebCacheHandler(GeoserverHandlerMixin):
 
     def can_run(self, layer, layer_config, *args, **kwargs):
         """
-        Only run this handler if the layer is found in Geoserver.
+        Only run this handler if the layer is found in Geoserver and was not configured by an earlier import.
         """
+        if merges_into_layer(layer_config):
+            return False
+
         self.layer = self.catalog.get_layer(layer)
 
         if self.layer:
@@ -283,16 +290,20 @@ class GeoWebCacheHandler(GeoserverHandlerMixin):
 
 class GeoServerBoundsHandler(GeoserverHandlerMixin):
     """
-    Sets the lat/long bounding box of a layer to the max extent of WGS84 if the values of the current lat/long
-    bounding box fail the Decimal quantize method (which Django uses internally when validating decimals).
+    Sets the lat/long bounding box of a layer to the extent of the source layer stored by the inspector, reprojected
+    to WGS84. Without a stored extent, the bounding box is set to the max extent of WGS84 if the values of the current
+    lat/long bounding box fail the Decimal quantize method (which Django uses internally when validating decimals).
 
     This can occur when the native bounding box contain Infinity values.
     """
 
     def can_run(self, layer, layer_config, *args, **kwargs):
         """
-        Only run this handler if the layer is found in Geoserver.
+        Only run this handler if the layer is found in Geoserver and was not configured by an earlier import.
         """
+        if merges_into_layer(layer_config):
+            return False
+
         self.catalog._cache.clear()
         self.layer = self.catalog.get_layer(layer)
 
@@ -304,6 +315,13 @@ class GeoServerBoundsHandler(GeoserverHandlerMixin):
     @ensure_can_run
     def handle(self, layer, layer_config, *args, **kwargs):
         resource = self.layer.resource
+        latlon_bbox = self.latlon_bbox(layer_config)
+
+        if latlon_bbox:
+            resource.latlon_bbox = latlon_bbox
+            self.catalog.save(resource)
+            return
+
         try:
             for dec in map(Decimal, resource.latlon_bbox[:4]):
                 dec.quantize(1)
@@ -312,6 +330,36 @@ class GeoServerBoundsHandler(GeoserverHandlerMixin):
             resource.latlon_bbox = ['-180', '180', '-90', '90', 'EPSG:4326']
             self.catalog.save(resource)
 
+    @staticmethod
+    def latlon_bbox(layer_config):
+        """
+        Returns the lat/long bounding box of the extent of the source layer, or None.
+        """
+        extent, srid = layer_config.get('extent'), layer_config.get('srid')
+
+        if not extent or not srid:
+            return
+
+        source = osr.SpatialReference()
+        source.ImportFromEPSG(srid)
+        target = osr.SpatialReference()
+        target.ImportFromEPSG(4326)
+        transform = osr.CoordinateTransformation(source, target)
+        min_x, max_x, min_y, max_y = extent
+
+        try:
+            points = [transform.TransformPoint(x, y)[:2] for x in (min_x, max_x) for y in (min_y, max_y)]
+            bbox = [min(x for x, _ in points), max(x for x, _ in points),
+                    min(y for _, y in points), max(y for _, y in points)]
+
+            for dec in map(Decimal, bbox):
+                dec.quantize(1)
+
+        except (RuntimeError, InvalidOperation):
+            return
+
+        return [str(value) for value in bbox] + ['EPSG:4326']
+
 
 class GenericSLDHandler(GeoserverHandlerMixin):
     """
@@ -322,6 +370,9 @@ class GenericSLDHandler(GeoserverHandlerMixin):
         """
         Only run this handler if the layer is found in Geoserver and the layer's style is the generic style.
         """
+        if merges_into_layer(layer_config):
+            return False
+
         self.catalog._cache.clear()
         self.layer = self.catalog.get_layer(layer)
 
@@ -350,6 +401,10 @@ class GeoServerStyleHandler(GeoserverHandlerMixin):
         if not any([layer_config.get('default_style', None), layer_config.get('styles', None)]):
             return False
 
+        # The styles of an existing layer are left as they are.
+        if merges_into_layer(layer_config):
+            return False
+
         return True
 
     @ensure_can_run
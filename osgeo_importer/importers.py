@@ -1,9 +1,12 @@
 import os
+import uuid
+import threading
+import billiard
 import ogr
 import osr
 import gdal
-from .inspectors import GDALInspector, OGRInspector
-from .utils import (  # noqa: F401
+from .inspectors import GDALInspector, OGRInspector, OGRTruncatedConverter, StreamConverter
+from .utils import (
     FileTypeNotAllowed,
     GdalErrorHandler,
     load_handler,
@@ -11,7 +14,10 @@ from .utils import (  # noqa: F401
     increment,
     increment_filename,
     raster_import,
-    decode
+    import_string,
+    DateFormat,
+    datastore_connection_string,
+    quote_ident
 )
 from .handlers import IMPORT_HANDLERS
 from django.conf import settings
@@ -25,6 +31,7 @@ ogr.UseExceptions()
 
 MEDIA_ROOT = getattr(settings, 'MEDIA_ROOT', FileSystemStorage().location)
 OSGEO_IMPORTER = getattr(settings, 'OSGEO_IMPORTER', 'osgeo_importer.importers.OGRImport')
+OSGEO_IMPORTER_WRITER = getattr(settings, 'OSGEO_IMPORTER_WRITER', 'osgeo_importer.writers.OGRFeatureWriter')
 DEFAULT_SUPPORTED_EXTENSIONS = ['shp', 'shx', 'prj', 'dbf', 'kml', 'geojson', 'json',
                                 'tif', 'tiff', 'gpkg', 'csv', 'zip', 'xml', 'sld']
 VALID_EXTENSIONS = getattr(settings, 'OSGEO_IMPORTER_VALID_EXTENSIONS', DEFAULT_SUPPORTED_EXTENSIONS)
@@ -32,6 +39,45 @@ VALID_EXTENSIONS = getattr(settings, 'OSGEO_IMPORTER_VALID_EXTENSIONS', DEFAULT_
 RASTER_FILES = getattr(settings, 'OSGEO_IMPORTER_RASTER_FILES', os.path.join(MEDIA_ROOT, 'osgeo_importer_raster'))
 UPLOAD_DIR = getattr(settings, 'OSGEO_IMPORTER_UPLOAD_DIR', os.path.join(MEDIA_ROOT, 'osgeo_importer_uploads'))
 
+# Make the files of uploads hard links to blobs named by the SHA-256 of their content, so identical uploads share
+# their disk space and inspection results, see osgeo_importer.blobs. Files are hashed when they are inspected.
+BLOB_DIR = getattr(settings, 'OSGEO_IMPORTER_BLOB_DIR', os.path.join(MEDIA_ROOT, 'osgeo_importer_blobs'))
+DEDUPLICATE_UPLOADS = getattr(settings, 'OSGEO_IMPORTER_DEDUPLICATE_UPLOADS', False)
+
+# Inspect uploaded files in the inspect_upload task instead of the upload request, which returns 202 with the id of
+# the upload as soon as the files are saved and checked to open. The upload's state goes from UPLOADED to INSPECTED.
+ASYNC_INSPECTION = getattr(settings, 'OSGEO_IMPORTER_ASYNC_INSPECTION', False)
+
+# Number of features written per transaction, a value of 1 or less writes features one at a time.
+BATCH_SIZE = getattr(settings, 'OSGEO_IMPORTER_BATCH_SIZE', 1000)
+
+# Number of processes used to import the layers of a multi-layer data set, 1 imports layers serially.
+WORKERS = getattr(settings, 'OSGEO_IMPORTER_WORKERS', 1)
+
+# When workers are enabled, layers with more features than this are split into chunks loaded in parallel.
+CHUNK_SIZE = getattr(settings, 'OSGEO_IMPORTER_CHUNK_SIZE', 250000)
+
+# Create PostGIS tables without a spatial index and build it once all features are loaded. Attribute indexes and
+# table statistics are handled by osgeo_importer.handlers.IndexHandler.
+DEFER_INDEXES = getattr(settings, 'OSGEO_IMPORTER_DEFER_INDEXES', False)
+
+# Load PostGIS layers into UNLOGGED staging tables that are made durable and renamed into place once the handlers
+# that modify data have run. Requires PostgreSQL 9.5+.
+STAGING_TABLES = getattr(settings, 'OSGEO_IMPORTER_STAGING_TABLES', False)
+
+# Compute the columns of the configured field converter (i.e. <field>_as_date) for the layer's `convert_to_date`
+# fields while features are first written, instead of rewriting the table in FieldConverterHandler. Values are then
+# parsed one by one in Python rather than by the set-based SQL of PostGISFieldConverter.
+STREAM_CONVERSION = getattr(settings, 'OSGEO_IMPORTER_STREAM_CONVERSION', False)
+
+# Number of staging rows copied per INSERT ... SELECT statement when appending to an existing layer.
+APPEND_BATCH_SIZE = getattr(settings, 'OSGEO_IMPORTER_APPEND_BATCH_SIZE', 100000)
+
+# Layer options the importer sets to pass state from the import to its handlers. They name the tables that are renamed,
+# merged and dropped and the field converter that is imported, so they are removed from the configuration options
+# before a layer is imported.
+INTERNAL_LAYER_OPTIONS = ('staging_table', 'target_name', 'stream_columns', 'converted_fields')
+
 if not os.path.exists(RASTER_FILES):
     os.makedirs(RASTER_FILES)
 
@@ -39,6 +85,63 @@ if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
 
+# Database connections inherited by a worker process from the importing process, see init_worker.
+INHERITED_CONNECTIONS = []
+
+
+def init_worker():
+    """
+    Makes a worker process open its own database connections. The inherited connections are only referenced, closing
+    them (or letting them be garbage collected) would also close the connections of the importing process, which may
+    be inside a transaction.
+    """
+    INHERITED_CONNECTIONS.extend(db.connections.all())
+    db.connections._connections = threading.local()
+
+
+def import_layer_worker(job):
+    """
+    Imports a single layer in a worker process of a parallel import.
+
+    :param job: A tuple of (importer class, filename, target store, writer, layer_options).
+    """
+    importer_class, filename, target_store, writer, layer_options = job
+    importer = importer_class(filename, target_store=target_store)
+    importer.writer = writer
+    err = GdalErrorHandler()
+    gdal.PushErrorHandler(err.handler)
+    gdal.UseExceptions()
+    data, _ = importer.open_source_datastore(filename)
+    return importer.import_layer(data, layer_options)
+
+
+def import_chunk_worker(job):
+    """
+    Loads a range of features of a source layer into an existing target layer in a worker process.
+
+    :param job: A tuple of (importer class, filename, target store, writer, layer_options, target layer name,
+    source fid field index, ignored source fields, start, stop).
+    :return: The number of features written.
+    """
+    (importer_class, filename, target_store, writer, layer_options, target_layer_name, source_fid, ignored_fields,
+     start, stop) = job
+    importer = importer_class(filename, target_store=target_store)
+    importer.writer = writer
+    err = GdalErrorHandler()
+    gdal.PushErrorHandler(err.handler)
+    gdal.UseExceptions()
+    data, _ = importer.open_source_datastore(filename)
+    target_file, _ = importer.open_target_datastore(target_store)
+    layer = data.GetLayer(layer_options.get('index'))
+
+    if ignored_fields:
+        layer.SetIgnoredFields(ignored_fields)
+
+    target_layer = target_file.GetLayerByName(target_layer_name)
+    features = importer.prepare_features(layer, target_layer, source_fid, start=start, stop=stop)
+    return importer.load_features(target_layer, features, layer_options)
+
+
 class Import(object):
     """
     Importers are responsible for opening incoming geospatial datasets (using one or many inspectors) and
@@ -107,8 +210,16 @@ class Import(object):
         """
         layers = self.import_file(configuration_options=configuration_options)
 
-        for layer, config in layers:
-            config['handler_results'] = self.run_import_handlers(layer, config)
+        for layer_info in layers:
+            layer, config = layer_info
+
+            try:
+                config['handler_results'] = self.run_import_handlers(layer, config)
+            except Exception:
+                self.abort_layer(layer, config)
+                raise
+
+            layer_info[0] = self.finalize_layer(layer, config)
 
         return layers
 
@@ -117,6 +228,9 @@ class Import(object):
         Handlers that are run on each layer of a data set. Each handler expects at least two arguments,
         the layer name and the layer configuration.
 
+        The layer is finalized (see `finalize_layer`) once the handlers that modify its data have run, before the
+        first handler that does not.
+
         :param layer: The name of the layer (returned from the import method).
         :param layer_config: Layer configuration options (dict) that is passed through to each handler.
         :return: A list of handler results.
@@ -124,10 +238,28 @@ class Import(object):
         self.handler_results = []
 
         for handler in self.import_handlers:
+            if not getattr(handler, 'modifies_data', False):
+                layer = self.finalize_layer(layer, layer_config)
+
             self.handler_results.append({type(handler).__name__: handler.handle(layer, layer_config, *args, **kwargs)})
 
         return self.handler_results
 
+    def finalize_layer(self, layer, layer_config):
+        """
+        A hook called once the handlers that modify the data of an imported layer have run. It must be safe to call
+        more than once.
+
+        :return: The name the layer should be published under.
+        """
+        return layer
+
+    def abort_layer(self, layer, layer_config):
+        """
+        A hook called when a handler fails, before the layer was finalized.
+        """
+        pass
+
     def open_datastore(self, connection_string, inspectors, *args, **kwargs):
         """
         Opens the source source data set using one or many inspectors.
@@ -159,18 +291,22 @@ class OGRImport(Import):
 
     source_inspectors = [GDALInspector]
     target_inspectors = [OGRInspector]
+    writer = OSGEO_IMPORTER_WRITER
+    workers = WORKERS
+    chunk_size = CHUNK_SIZE
+    defer_indexes = DEFER_INDEXES
+    staging_tables = STAGING_TABLES
+    stream_conversion = STREAM_CONVERSION
+    hash_column = 'import_hash'
 
     def __init__(self, filename, target_store=None, upload_file=None):
         self.file = filename
         self.upload_file = upload_file
         self.completed_layers = []
+        self.target_store = target_store
 
         if target_store is None:
-            d = db.connections[settings.OSGEO_DATASTORE].settings_dict
-            connection_string = "PG:dbname='%s' user='%s' password='%s' host='%s' port='%s'" % (d['NAME'], d['USER'],
-                                                                                                d['PASSWORD'],
-                                                                                                d['HOST'], d['PORT'])
-            self.target_store = connection_string
+            self.target_store = datastore_connection_string()
 
     def open_target_datastore(self, connection_string, *args, **kwargs):
         """
@@ -185,7 +321,7 @@ class OGRImport(Import):
         """
         return target_datastore.CreateLayer(layer_name, *args, **kwargs)
 
-    def get_layer_type(self, layer, source):
+    def get_layer_type(self, layer, source, layer_options=None):
         """
         A hook for returning the GeometryType of a layer.
 
@@ -195,12 +331,17 @@ class OGRImport(Import):
         or OGRMultiLineString. The same applies for SHPT_POLYGON shapefiles, reported as layers of type wkbPolygon,
         but depending on the number of parts of each geometry, the actual type can be either OGRPolygon or
         OGRMultiPolygon.
+
+        Layers that the inspector found to have no multi-part geometries (`multipart` is False) keep their type.
         """
         driver = source.GetDriver().LongName
 
         if driver == 'ESRI Shapefile':
             geom_type = layer.GetGeomType()
 
+            if layer_options and layer_options.get('multipart') is False:
+                return geom_type
+
             # If point return MultiPoint
             if geom_type == 1:
                 return 4
@@ -215,6 +356,127 @@ class OGRImport(Import):
 
         return layer.GetGeomType()
 
+    def prepare_features(self, layer, target_layer, source_fid=None, start=0, stop=None):
+        """
+        Yields the features of the source layer that have a geometry, ready to be written to the target layer.
+
+        Geometries are promoted to the multi-geometry type of the target layer when needed and the FID is either
+        reset (so the target assigns one) or taken from the source field matching the target FID column.
+
+        Features are read sequentially, random access by FID is slow with many drivers (CSV, GeoJSON, KML, GPX)
+        and would skip features when FIDs do not start at 0.
+
+        :param start: The index of the first feature to read.
+        :param stop: The index of the feature to stop reading at, None reads to the end of the layer.
+        """
+        layer.ResetReading()
+
+        if start:
+            layer.SetNextByIndex(start)
+
+        for index, feature in enumerate(iter(layer.GetNextFeature, None), start):
+
+            if stop is not None and index >= stop:
+                break
+
+            if feature.geometry():
+
+                if not layer.GetFIDColumn():
+                    feature.SetFID(-1)
+
+                if feature.geometry().GetGeometryType() != target_layer.GetGeomType() and \
+                        target_layer.GetGeomType() in range(4, 7):
+
+                    conversion_function = ogr.ForceToMultiPolygon
+
+                    if target_layer.GetGeomType() == 5:
+                        conversion_function = ogr.ForceToMultiLineString
+
+                    elif target_layer.GetGeomType() == 4:
+                        conversion_function = ogr.ForceToMultiPoint
+
+                    geom = ogr.CreateGeometryFromWkb(feature.geometry().ExportToWkb())
+                    feature.SetGeometry(conversion_function(geom))
+
+                if source_fid is not None:
+                    feature.SetFID(feature.GetField(source_fid))
+
+                yield feature
+
+    def load_features(self, target_layer, features, layer_options):
+        """
+        Writes the prepared features to the target layer using the configured writer.
+
+        :return: The number of features written.
+        """
+        kwargs = {'batch_size': layer_options.get('batch_size', BATCH_SIZE), 'target_store': self.target_store}
+        converter = self.get_stream_converter(layer_options)
+
+        if converter is not None:
+            kwargs['converter'] = converter
+
+        writer = load_handler(self.writer, target_layer, layer_options, **kwargs)
+        return writer.write(features)
+
+    def get_field_converter(self):
+        """
+        Returns the field converter class of the first enabled handler that has one (i.e. FieldConverterHandler).
+        """
+        for handler in self.import_handlers:
+            field_converter = getattr(handler, 'field_converter', None)
+
+            if field_converter is not None:
+                return field_converter
+
+    def create_stream_columns(self, layer, target_layer, layer_options):
+        """
+        Adds the columns of the configured field converter for the `convert_to_date` fields of a layer to the
+        target layer before it is loaded, so they are computed while the features are written.
+
+        The columns are recorded in `stream_columns` (used to rebuild the converter in worker processes) and the
+        converted fields in `converted_fields`, which FieldConverterHandler skips.
+        """
+        fields = layer_options.get('convert_to_date')
+
+        if not fields or not layer_options.get('stream_conversion', self.stream_conversion):
+            return
+
+        field_converter = self.get_field_converter()
+
+        if field_converter is None or not getattr(field_converter, 'stream_columns', None):
+            return
+
+        layer_definition = layer.GetLayerDefn()
+        source_fields = [layer_definition.GetFieldDefn(i).GetName() for i in range(layer_definition.GetFieldCount())]
+        modified_fields = layer_options.get('modified_fields', {})
+        columns = []
+        converted_fields = {}
+
+        for field in sorted(set(fields)):
+            if field not in source_fields:
+                continue
+
+            target_field = modified_fields.get(field, field)
+            names = field_converter.create_stream_columns(target_layer, target_field)
+            columns.append([field, names])
+            converted_fields[target_field] = names[0]
+
+        if columns:
+            layer_options['stream_columns'] = {'converter': '{0}.{1}'.format(field_converter.__module__,
+                                                                             field_converter.__name__),
+                                               'columns': columns}
+            layer_options['converted_fields'] = converted_fields
+
+    @staticmethod
+    def get_stream_converter(layer_options):
+        stream_columns = layer_options.get('stream_columns')
+
+        if stream_columns:
+            date_formats = dict((field['name'], DateFormat.from_description(field.get('date_format')))
+                                for field in layer_options.get('fields', []))
+            return StreamConverter(import_string(stream_columns['converter']), stream_columns['columns'],
+                                   date_formats)
+
     def import_file(self, *args, **kwargs):
         """
         Loads data that has been uploaded into whatever format we need for serving.
@@ -233,7 +495,12 @@ class OGRImport(Import):
 
         data, inspector = self.open_source_datastore(filename, *args, **kwargs)
 
-        datastore_layers = inspector.describe_fields()
+        # The geometries of uploaded layers were described when the upload was inspected.
+        stored_layers = self.stored_descriptions()
+        datastore_layers = inspector.describe_fields(describe_geometries=False if stored_layers else None)
+
+        for datastore_layer in datastore_layers:
+            datastore_layer.update(stored_layers.get(datastore_layer.get('index'), {}))
 
         if len(datastore_layers) == 0:
             logger.debug('No Dataset found')
@@ -256,142 +523,512 @@ class OGRImport(Import):
                     layer_configuration.update(datastore_layer)
                     layers_info.append(layer_configuration)
 
-        for layer_options in layers_info:
-            if layer_options['raster']:
-                """
-                File is a raster, we need to convert into optimized GeoTiff
-                and skip any further testing or loading into target_store
-                """
-                #  Increment filename to make sure target doesn't exists
-                filedir, filebase = os.path.split(filename)
-                outfile = '%s.tif' % os.path.splitext(filebase)[0]
-                fileout = increment_filename(os.path.join(RASTER_FILES, outfile))
-                raster_import(layer_options['path'], fileout)
-                self.completed_layers.append([fileout, layer_options])
-            else:
-                target_file, _ = self.open_target_datastore(self.target_store)
-                target_create_options = []
-
-                # Prevent numeric field overflow for shapefiles https://trac.osgeo.org/gdal/ticket/5241
-                if target_file.GetDriver().GetName() == 'PostgreSQL':
-                    target_create_options.append('PRECISION=NO')
-
-                layer_options['modified_fields'] = {}
-                layer = data.GetLayer(layer_options.get('index'))
-                layer_name = layer_options.get('name', layer.GetName().lower())
-                layer_type = self.get_layer_type(layer, data)
-                srs = layer.GetSpatialRef()
-
-                if layer_name.lower() == 'ogrgeojson':
-                    try:
-                        layer_name = os.path.splitext(os.path.basename(filename))[0].lower()
-                    except IndexError:
-                        pass
-
-                layer_name = launder(str(layer_name))
-
-                # default the layer to 4326 if a spatial reference is not provided
-                if not srs:
-                    srs = osr.SpatialReference()
-                    srs.ImportFromEPSG(4326)
-
-                # pass the srs authority code to handlers
-                if srs.AutoIdentifyEPSG() == 0:
-                    layer_options['srs'] = '{0}:{1}'.format(srs.GetAuthorityName(None), srs.GetAuthorityCode(None))
-
-                n = 0
-                while True:
-                    n += 1
-                    try:
-                        target_layer = self.create_target_dataset(target_file, layer_name, srs, layer_type,
-                                                                  options=target_create_options)
-                    except RuntimeError as e:
-                        # logger.exception('exception in creating target dataset')
-                        # the layer already exists in the target store, increment the name
-                        if 'Use the layer creation option OVERWRITE=YES to replace it.' in e.message:
-                            layer_name = increment(layer_name)
-
-                            # try 100 times to increment then break
-                            if n >= 100:
-                                break
-
-                            continue
-                        else:
-                            raise e
-                    break
-
-                # adding fields to new layer
-                layer_definition = ogr.Feature(layer.GetLayerDefn())
-                source_fid = None
-
-                wkb_field = 0
-
-                for i in range(layer_definition.GetFieldCount()):
-
-                    field_def = layer_definition.GetFieldDefnRef(i)
-
-                    if field_def.GetName() == target_layer.GetFIDColumn() and field_def.GetType() != 0:
-                        field_def.SetType(0)
-
-                    if field_def.GetName() != 'wkb_geometry':
-                        target_layer.CreateField(field_def)
-                        new_name = target_layer.GetLayerDefn().GetFieldDefn(i - wkb_field).GetName()
-                        old_name = field_def.GetName()
-
-                        if new_name != old_name:
-                            layer_options['modified_fields'][old_name] = new_name
-
-                        if old_name == target_layer.GetFIDColumn() and not layer.GetFIDColumn():
-                            source_fid = i
+        if self.workers > 1 and len(layers_info) > 1:
+            self.completed_layers = self.import_layers_parallel(layers_info)
+        else:
+            for layer_options in layers_info:
+                self.completed_layers.append(self.import_layer(data, layer_options))
+
+        return self.completed_layers
+
+    def stored_descriptions(self):
+        """
+        Returns the extent, srid, geometry types and multipart flag stored on the upload layers of the upload file
+        by index, or an empty dict.
+        """
+        if self.upload_file is None:
+            return {}
+
+        fields = ('extent', 'srid', 'geometry_types', 'multipart')
+        return dict((values['index'], dict((field, values[field]) for field in fields))
+                    for values in self.upload_file.uploadlayer_set.filter(raster=False).values('index', *fields))
+
+    def import_layer(self, data, layer_options):
+        """
+        Imports a single layer of the source data set.
+
+        :param data: The opened source data set.
+        :param layer_options: The layer configuration, updated with the layer's description.
+        :return: A list of [layername, layer_options].
+        """
+        for option in INTERNAL_LAYER_OPTIONS:
+            layer_options.pop(option, None)
+
+        if layer_options['raster']:
+            """
+            File is a raster, we need to convert into optimized GeoTiff
+            and skip any further testing or loading into target_store
+            """
+            #  Increment filename to make sure target doesn't exists
+            filedir, filebase = os.path.split(self.file)
+            outfile = '%s.tif' % os.path.splitext(filebase)[0]
+            fileout = increment_filename(os.path.join(RASTER_FILES, outfile))
+            raster_import(layer_options['path'], fileout)
+            return [fileout, layer_options]
+        else:
+            target_file, _ = self.open_target_datastore(self.target_store)
+            target_create_options = []
+
+            defer_indexes = False
+            staging = False
+
+            # Prevent numeric field overflow for shapefiles https://trac.osgeo.org/gdal/ticket/5241
+            if target_file.GetDriver().GetName() == 'PostgreSQL':
+                target_create_options.append('PRECISION=NO')
+                defer_indexes = layer_options.get('defer_indexes', self.defer_indexes)
+                # Appends and re-imports are always loaded into a staging table that is merged into the existing table.
+                staging = (layer_options.get('staging_tables', self.staging_tables) or
+                           'appendTo' in layer_options or 'reimportTo' in layer_options)
+
+            # Maintaining the spatial index during the load is much slower than building it afterwards.
+            if defer_indexes:
+                target_create_options.append('SPATIAL_INDEX=NO')
+
+            layer_options['modified_fields'] = {}
+            layer = data.GetLayer(layer_options.get('index'))
+            layer_name = layer_options.get('name', layer.GetName().lower())
+            layer_type = self.get_layer_type(layer, data, layer_options)
+            srs = layer.GetSpatialRef()
+
+            if layer_name.lower() == 'ogrgeojson':
+                try:
+                    layer_name = os.path.splitext(os.path.basename(self.file))[0].lower()
+                except IndexError:
+                    pass
+
+            layer_name = launder(str(layer_name))
+
+            # Load into a uniquely named staging table, the final name is picked when the table is swapped into place.
+            if staging:
+                layer_options['target_name'] = layer_name
+                layer_name = 'import_{0}'.format(uuid.uuid4().hex)
+
+            # default the layer to 4326 if a spatial reference is not provided
+            if not srs:
+                srs = osr.SpatialReference()
+                srs.ImportFromEPSG(4326)
+
+            # pass the srs authority code to handlers
+            if srs.AutoIdentifyEPSG() == 0:
+                layer_options['srs'] = '{0}:{1}'.format(srs.GetAuthorityName(None), srs.GetAuthorityCode(None))
+
+            n = 0
+            while True:
+                n += 1
+                try:
+                    target_layer = self.create_target_dataset(target_file, layer_name, srs, layer_type,
+                                                              options=target_create_options)
+                except RuntimeError as e:
+                    # logger.exception('exception in creating target dataset')
+                    # the layer already exists in the target store, increment the name
+                    if 'Use the layer creation option OVERWRITE=YES to replace it.' in e.message:
+                        layer_name = increment(layer_name)
+
+                        # try 100 times to increment then break
+                        if n >= 100:
+                            break
+
+                        continue
                     else:
-                        wkb_field = 1
+                        raise e
+                break
 
-                if wkb_field is not 0:
-                    layer.SetIgnoredFields(['wkb_geometry'])
+            # adding fields to new layer
+            layer_definition = ogr.Feature(layer.GetLayerDefn())
+            source_fid = None
 
-                for i in range(0, layer.GetFeatureCount()):
-                    feature = layer.GetFeature(i)
+            wkb_field = 0
 
-                    if feature and feature.geometry():
+            for i in range(layer_definition.GetFieldCount()):
 
-                        if not layer.GetFIDColumn():
-                            feature.SetFID(-1)
+                field_def = layer_definition.GetFieldDefnRef(i)
 
-                        if feature.geometry().GetGeometryType() != target_layer.GetGeomType() and \
-                                target_layer.GetGeomType() in range(4, 7):
+                if field_def.GetName() == target_layer.GetFIDColumn() and field_def.GetType() != 0:
+                    field_def.SetType(0)
 
-                            conversion_function = ogr.ForceToMultiPolygon
+                if field_def.GetName() != 'wkb_geometry':
+                    target_layer.CreateField(field_def)
+                    new_name = target_layer.GetLayerDefn().GetFieldDefn(i - wkb_field).GetName()
+                    old_name = field_def.GetName()
 
-                            if target_layer.GetGeomType() == 5:
-                                conversion_function = ogr.ForceToMultiLineString
+                    if new_name != old_name:
+                        layer_options['modified_fields'][old_name] = new_name
 
-                            elif target_layer.GetGeomType() == 4:
-                                conversion_function = ogr.ForceToMultiPoint
+                    if old_name == target_layer.GetFIDColumn() and not layer.GetFIDColumn():
+                        source_fid = i
+                else:
+                    wkb_field = 1
 
-                            geom = ogr.CreateGeometryFromWkb(feature.geometry().ExportToWkb())
-                            feature.SetGeometry(conversion_function(geom))
+            self.create_stream_columns(layer, target_layer, layer_options)
 
-                        if source_fid is not None:
-                            feature.SetFID(feature.GetField(source_fid))
+            if staging:
+                layer_options['staging_table'] = target_layer.GetName()
+                target_layer.SyncToDisk()
+                self.execute_sql('ALTER TABLE {0} SET UNLOGGED'.format(quote_ident(target_layer.GetName())))
 
-                        try:
-                            target_layer.CreateFeature(feature)
+            ignored_fields = []
 
-                        except:
-                            for field in range(0, feature.GetFieldCount()):
-                                if feature.GetFieldType(field) == ogr.OFTString:
-                                    try:
-                                        feature.GetField(field).decode('utf8')
-                                    except UnicodeDecodeError:
-                                        feature.SetField(field, decode(feature.GetField(field)))
-                                    except AttributeError:
-                                        continue
-                            try:
-                                target_layer.CreateFeature(feature)
-                            except err as e:
-                                logger.error('Create feature failed: {0}'.format(gdal.GetLastErrorMsg()))
-                                raise e
+            if wkb_field is not 0:
+                ignored_fields.append('wkb_geometry')
+                layer.SetIgnoredFields(ignored_fields)
 
-                self.completed_layers.append([target_layer.GetName(), layer_options])
+            try:
+                chunks = self.get_chunks(layer)
 
-        return self.completed_layers
+                if chunks:
+                    self.load_chunks(layer_options, target_layer, source_fid, ignored_fields, chunks)
+                else:
+                    features = self.prepare_features(layer, target_layer, source_fid)
+                    self.load_features(target_layer, features, layer_options)
+
+                stream_converter = self.get_stream_converter(layer_options)
+
+                if stream_converter is not None:
+                    stream_converter.field_converter.finish_stream(target_layer.GetName(), stream_converter.columns)
+
+                if defer_indexes:
+                    self.create_spatial_index(target_layer)
+            except Exception:
+                # Never leave a partially loaded staging table behind.
+                if staging:
+                    self.abort_layer(target_layer.GetName(), layer_options)
+                raise
+
+            return [target_layer.GetName(), layer_options]
+
+    def execute_sql(self, *queries):
+        """
+        Executes queries against the target datastore in a single transaction.
+        """
+        with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+            cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+
+            for query in queries:
+                cursor.execute(query)
+
+    @staticmethod
+    def table_exists(name):
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('SELECT 1 FROM information_schema.tables WHERE table_name = %s', (name,))
+        return cursor.fetchone() is not None
+
+    def finalize_layer(self, layer, layer_config):
+        """
+        Makes a staging table durable and renames it to the layer's target name (incremented if a table with that
+        name already exists) in a single transaction.
+        """
+        staging_table = layer_config.get('staging_table')
+
+        if not staging_table:
+            return layer_config.get('target_name', layer)
+
+        if layer_config.get('appendTo') or layer_config.get('reimportTo'):
+            merge = self.append_layer if layer_config.get('appendTo') else self.reimport_layer
+
+            with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+                target_name = merge(staging_table, layer_config)
+                self.execute_sql('DROP TABLE {0}'.format(quote_ident(staging_table)))
+
+            del layer_config['staging_table']
+            layer_config['target_name'] = target_name
+            return target_name
+
+        with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+            target_name = layer_config['target_name']
+            n = 0
+
+            while self.table_exists(target_name) and n < 100:
+                target_name = increment(target_name)
+                n += 1
+
+            self.execute_sql('ALTER TABLE {0} SET LOGGED'.format(quote_ident(staging_table)),
+                             'ALTER TABLE {0} RENAME TO {1}'.format(quote_ident(staging_table),
+                                                                    quote_ident(target_name)))
+
+        del layer_config['staging_table']
+        layer_config['target_name'] = target_name
+        return target_name
+
+    def append_layer(self, staging_table, layer_config):
+        """
+        Copies the features of a staging table into the existing table named by `appendTo` using batched
+        INSERT ... SELECT statements. Fields truncated by the shapefile format are mapped to the destination's
+        names with the OGRTruncatedConverter, which raises an AttributeError when the schemas are not compatible.
+
+        When `upsert_key` is set, rows whose key already exists in the destination table are updated instead of
+        inserted. The key must have a unique index in the destination, the existing table is never changed to add one.
+
+        :return: The name of the table the features were appended to.
+        """
+        append_to = layer_config['appendTo'].split(':')[-1]
+
+        with OGRTruncatedConverter(self.target_store) as converter:
+            mapping = converter.convert_truncated(staging_table, append_to)
+            source = converter.data.GetLayerByName(staging_table)
+            dest = converter.data.GetLayerByName(append_to)
+
+            columns, geometry = self.merge_columns(source, dest)
+            source_fid = source.GetFIDColumn()
+
+            insert_columns = [quote_ident(dest.GetGeometryColumn())] + [quote_ident(column) for column in columns]
+            select_columns = [geometry] + [quote_ident(column) for column in columns]
+
+        query = 'INSERT INTO {0} ({1}) SELECT {2} FROM {3} WHERE {4} > %s AND {4} <= %s'
+        upsert_key = layer_config.get('upsert_key')
+
+        if upsert_key:
+            upsert_key = layer_config.get('modified_fields', {}).get(upsert_key, upsert_key)
+
+            if isinstance(mapping, dict):
+                upsert_key = mapping.get(upsert_key, upsert_key)
+
+            if upsert_key not in columns:
+                raise AttributeError('Upsert key {0} is not an attribute of {1}.'.format(upsert_key, append_to))
+
+            if not self.has_unique_index(append_to, upsert_key):
+                raise AttributeError('Upsert key {0} of {1} has no unique index.'.format(upsert_key, append_to))
+
+            # A row can only be updated once per statement, keep the last feature of each key in a batch.
+            query = ('INSERT INTO {0} ({1}) SELECT DISTINCT ON ({5}) {2} FROM {3} WHERE {4} > %s AND {4} <= %s '
+                     'ORDER BY {5}, {4} DESC ON CONFLICT ({5}) DO UPDATE SET {6}')
+
+        key = quote_ident(upsert_key) if upsert_key else None
+        updates = ', '.join('{0} = EXCLUDED.{0}'.format(column) for column in insert_columns if column != key)
+        query = query.format(quote_ident(append_to), ', '.join(insert_columns), ', '.join(select_columns),
+                             quote_ident(staging_table), quote_ident(source_fid), key, updates)
+
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('SELECT min({1}), max({1}) FROM {0}'.format(quote_ident(staging_table),
+                                                                  quote_ident(source_fid)))
+        first, last = cursor.fetchone()
+
+        if first is not None:
+            for start in range(first - 1, last, APPEND_BATCH_SIZE):
+                cursor.execute(query, (start, start + APPEND_BATCH_SIZE))
+
+        return append_to
+
+    def reimport_layer(self, staging_table, layer_config):
+        """
+        Applies a new version of a data set, loaded into a staging table, to the table named by `reimportTo` by
+        only inserting, updating and deleting the features that changed.
+
+        Features are compared using an md5 hash of their attributes and geometry that is stored in the `hash_column`
+        of the target table, which is added and filled the first time a table is re-imported. When `reimport_key`
+        names an attribute that identifies features across versions, changed features are updated in place,
+        otherwise they are deleted and inserted again.
+
+        The number of inserted, updated and deleted features is stored in the layer configuration's `reimport` key.
+
+        :return: The name of the re-imported table.
+        """
+        dest_name = layer_config['reimportTo'].split(':')[-1]
+
+        with OGRTruncatedConverter(self.target_store) as converter:
+            mapping = converter.convert_truncated(staging_table, dest_name)
+            source = converter.data.GetLayerByName(staging_table)
+            dest = converter.data.GetLayerByName(dest_name)
+            columns, geometry = self.merge_columns(source, dest)
+            _, source_geometry = self.merge_columns(source, dest, alias='s')
+            columns = [column for column in columns if column != self.hash_column]
+            dest_geometry = quote_ident(dest.GetGeometryColumn())
+            has_hash = dest.GetLayerDefn().GetFieldIndex(self.hash_column) >= 0
+
+        key = layer_config.get('reimport_key')
+
+        if key:
+            key = layer_config.get('modified_fields', {}).get(key, key)
+
+            if isinstance(mapping, dict):
+                key = mapping.get(key, key)
+
+            if key not in columns:
+                raise AttributeError('Re-import key {0} is not an attribute of {1}.'.format(key, dest_name))
+
+            key = quote_ident(key)
+
+        quoted_columns = [quote_ident(column) for column in columns]
+        hash_column = quote_ident(self.hash_column)
+        target, staging_table = quote_ident(dest_name), quote_ident(staging_table)
+
+        def feature_hash(geometry):
+            return "md5(ROW({0})::text || coalesce(encode(ST_AsBinary({1}), 'hex'), ''))".format(
+                ', '.join(quoted_columns), geometry)
+
+        queries = ['ALTER TABLE {0} ADD COLUMN {1} char(32)'.format(staging_table, hash_column),
+                   'UPDATE {0} SET {1} = {2}'.format(staging_table, hash_column, feature_hash(geometry)),
+                   'CREATE INDEX ON {0} ({1})'.format(staging_table, key or hash_column),
+                   'ANALYZE {0}'.format(staging_table)]
+
+        if not has_hash:
+            queries += ['ALTER TABLE {0} ADD COLUMN {1} char(32)'.format(target, hash_column),
+                        'UPDATE {0} SET {1} = {2}'.format(target, hash_column, feature_hash(dest_geometry)),
+                        'CREATE INDEX ON {0} ({1})'.format(target, hash_column)]
+
+        match = 's.{0} = t.{0}'.format(key or hash_column)
+        insert_columns = ', '.join([dest_geometry, hash_column] + quoted_columns)
+        select_columns = ', '.join([geometry, hash_column] + quoted_columns)
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        changes = {}
+
+        for query in queries:
+            cursor.execute(query)
+
+        cursor.execute('DELETE FROM {0} t WHERE NOT EXISTS (SELECT 1 FROM {1} s WHERE {2})'.format(
+            target, staging_table, match))
+        changes['deleted'] = cursor.rowcount
+
+        if key:
+            assignments = ', '.join(['{0} = {1}'.format(dest_geometry, source_geometry)] +
+                                    ['{0} = s.{0}'.format(column) for column in [hash_column] + quoted_columns])
+            cursor.execute('UPDATE {0} t SET {1} FROM {2} s WHERE {3} AND s.{4} IS DISTINCT FROM t.{4}'.format(
+                target, assignments, staging_table, match, hash_column))
+            changes['updated'] = cursor.rowcount
+        else:
+            changes['updated'] = 0
+
+        cursor.execute('INSERT INTO {0} ({1}) SELECT {2} FROM {3} s WHERE NOT EXISTS '
+                       '(SELECT 1 FROM {0} t WHERE {4})'.format(target, insert_columns, select_columns,
+                                                                staging_table, match))
+        changes['inserted'] = cursor.rowcount
+
+        layer_config['reimport'] = changes
+        logger.info('Re-imported {0}: {1}'.format(target, changes))
+        return dest_name
+
+    @staticmethod
+    def merge_columns(source, dest, alias=None):
+        """
+        Returns the attribute columns two layers have in common, excluding their FID columns, and the SQL expression
+        that converts the source layer's geometry column, qualified with `alias` if given, to the destination's
+        geometry type.
+        """
+        source_definition = source.GetLayerDefn()
+        dest_definition = dest.GetLayerDefn()
+        dest_fields = [dest_definition.GetFieldDefn(i).GetName() for i in range(dest_definition.GetFieldCount())]
+        columns = [source_definition.GetFieldDefn(i).GetName() for i in range(source_definition.GetFieldCount())]
+        columns = [column for column in columns
+                   if column in dest_fields and column not in (source.GetFIDColumn(), dest.GetFIDColumn())]
+
+        geometry = quote_ident(source.GetGeometryColumn())
+
+        if alias:
+            geometry = '{0}.{1}'.format(alias, geometry)
+
+        # Shapefiles mix single and multi-part geometries, promote them when the destination only holds the latter.
+        if ogr.GT_Flatten(dest.GetGeomType()) in (ogr.wkbMultiPoint, ogr.wkbMultiLineString, ogr.wkbMultiPolygon):
+            geometry = 'ST_Multi({0})'.format(geometry)
+
+        return columns, geometry
+
+    @staticmethod
+    def has_unique_index(table, column):
+        """
+        Returns True if a column has a unique index, as required by INSERT ... ON CONFLICT.
+        """
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('SELECT 1 FROM pg_index i JOIN pg_attribute a ON a.attrelid = i.indrelid '
+                       'AND a.attnum = i.indkey[0] WHERE i.indrelid = %s::regclass AND i.indisunique '
+                       'AND i.indnatts = 1 AND a.attname = %s', (quote_ident(table), column))
+        return cursor.fetchone() is not None
+
+    def abort_layer(self, layer, layer_config):
+        """
+        Drops the staging table of a failed import.
+        """
+        staging_table = layer_config.pop('staging_table', None)
+
+        if staging_table:
+            self.execute_sql('DROP TABLE IF EXISTS {0}'.format(quote_ident(staging_table)))
+
+    def create_spatial_index(self, target_layer):
+        """
+        Builds the spatial index of a PostGIS table that was created without one.
+        """
+        target_layer.SyncToDisk()
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        cursor.execute('CREATE INDEX ON {0} USING GIST ({1})'.format(quote_ident(target_layer.GetName()),
+                                                                     quote_ident(target_layer.GetGeometryColumn())))
+
+    def map_workers(self, func, jobs):
+        """
+        Runs `func` over `jobs` in a pool of `workers` processes.
+
+        The pool is a billiard (celery's fork of multiprocessing) pool, which unlike multiprocessing can be started
+        from the daemonic processes of celery's prefork workers, where import_object runs.
+
+        :return: The list of results in the order of `jobs`, or None when there are no jobs.
+        """
+        if not jobs:
+            return
+
+        pool = billiard.Pool(processes=min(self.workers, len(jobs)), initializer=init_worker)
+
+        try:
+            return pool.map(func, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_chunks(self, layer):
+        """
+        Returns a list of (start, stop) feature index ranges used to load a layer in parallel, or None if the layer
+        should be loaded by a single process.
+
+        Layers are only split when workers are enabled, the driver can seek to a feature index quickly and the layer
+        holds more than `chunk_size` features.
+        """
+        if self.workers <= 1 or not layer.TestCapability(ogr.OLCFastSetNextByIndex):
+            return
+
+        feature_count = layer.GetFeatureCount()
+
+        if feature_count <= self.chunk_size:
+            return
+
+        return [(start, min(start + self.chunk_size, feature_count))
+                for start in range(0, feature_count, self.chunk_size)]
+
+    def load_chunks(self, layer_options, target_layer, source_fid, ignored_fields, chunks):
+        """
+        Loads ranges of features of a single layer into the target layer using a pool of workers.
+
+        :return: The number of features written.
+        """
+        # OGR defers the creation of new PostgreSQL tables, make sure the table exists before the workers write to it.
+        target_layer.ResetReading()
+        target_layer.SyncToDisk()
+
+        jobs = [(type(self), self.file, self.target_store, self.writer, layer_options, target_layer.GetName(),
+                 source_fid, ignored_fields, start, stop) for start, stop in chunks]
+        return sum(self.map_workers(import_chunk_worker, jobs))
+
+    def import_layers_parallel(self, layers_info):
+        """
+        Imports vector layers in a pool of `workers` processes, each worker opens its own source and target data
+        sets. Raster layers are imported by this process since their output file names are chosen by probing the
+        file system.
+
+        :return: A list of [layername, layer_options] in the same order as `layers_info`.
+        """
+        completed_layers = [None] * len(layers_info)
+        vector_layers = [(i, layer_options) for i, layer_options in enumerate(layers_info)
+                         if not layer_options['raster']]
+        jobs = [(type(self), self.file, self.target_store, self.writer, layer_options)
+                for _, layer_options in vector_layers]
+        results = self.map_workers(import_layer_worker, jobs)
+
+        if results is not None:
+            for (i, layer_options), (layer_name, options) in zip(vector_layers, results):
+                # Keep the caller's configuration dict up to date, like a serial import does.
+                layer_options.update(options)
+                completed_layers[i] = [layer_name, layer_options]
+
+        data = None
+        for i, layer_options in enumerate(layers_info):
+            if completed_layers[i] is None:
+                if data is None:
+                    data, _ = self.open_source_datastore(self.file)
+                completed_layers[i] = self.import_layer(data, layer_options)
+
+        return completed_layers
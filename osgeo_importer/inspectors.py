@@ -1,14 +1,114 @@
+import copy
+import itertools
+import logging
 import os
+import threading
+import uuid
+from multiprocessing.pool import ThreadPool
 
 import gdal
 import ogr
 from django.conf import settings
-from .utils import NoDataSourceFound, GDAL_GEOMETRY_TYPES, increment, timeparse, quote_ident, parse
+from .utils import (
+    NoDataSourceFound,
+    GDAL_GEOMETRY_TYPES,
+    DATE_SAMPLE_SIZE,
+    LRUCache,
+    file_fingerprint,
+    increment,
+    infer_date_format,
+    timeparse,
+    timeparse_many,
+    quote_ident,
+    parse
+)
 
 from django import db
 
+logger = logging.getLogger(__name__)
 OSGEO_INSPECTOR = getattr(settings, 'OSGEO_INSPECTOR', 'osgeo_importer.inspectors.GDALInspector')
 
+# Infer the date format of string fields in describe_fields, see osgeo_importer.utils.infer_date_format.
+INFER_DATE_FORMATS = getattr(settings, 'OSGEO_IMPORTER_INFER_DATE_FORMATS', True)
+
+# Number of GDALInspector.describe_fields and file_type results kept per process, keyed by the fingerprint of the
+# inspected file. 0 disables the cache.
+DESCRIBE_CACHE_SIZE = getattr(settings, 'OSGEO_IMPORTER_DESCRIBE_CACHE_SIZE', 128)
+DESCRIBE_CACHE = LRUCache(DESCRIBE_CACHE_SIZE)
+
+# Number of threads used by describe_fields to open the subdatasets of a raster (i.e. NetCDF, HDF) and add their
+# size, band count and SRS to their description. With 0, subdatasets are only opened when they are imported.
+SUBDATASET_METADATA_THREADS = getattr(settings, 'OSGEO_IMPORTER_SUBDATASET_METADATA_THREADS', 0)
+
+# Add the extent, EPSG code and geometry types of each vector layer to describe_fields, see describe_geometries.
+DESCRIBE_GEOMETRIES = getattr(settings, 'OSGEO_IMPORTER_DESCRIBE_GEOMETRIES', True)
+
+# Number of features whose geometry type is sampled by describe_geometries.
+GEOMETRY_SAMPLE_SIZE = getattr(settings, 'OSGEO_IMPORTER_GEOMETRY_SAMPLE_SIZE', 1000)
+
+
+class DatasetPool(object):
+    """
+    Shares the datasets opened by GDALInspector during a request or task.
+
+    While a pool is active, inspectors opening a file with the same open options reuse the dataset that was opened
+    first instead of opening and parsing the file again. The datasets are released when the outermost pool exits,
+    GDAL closes them once the inspectors using them are gone too. Pools are per thread and per process, since GDAL
+    datasets can't be shared between threads or forked workers.
+
+    Usage::
+
+        with DatasetPool():
+            ...
+    """
+    local = threading.local()
+
+    def __enter__(self):
+        if getattr(self.local, 'pid', None) != os.getpid():
+            self.local.pid = os.getpid()
+            self.local.depth = 0
+
+        self.local.depth += 1
+
+        if self.local.depth == 1:
+            self.local.datasets = {}
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.local.depth -= 1
+
+        if not self.local.depth:
+            datasets = self.local.datasets
+            self.local.datasets = None
+            datasets.clear()
+
+    @classmethod
+    def datasets(cls):
+        """
+        Returns the datasets of the active pool, or None.
+        """
+        if getattr(cls.local, 'pid', None) == os.getpid():
+            return cls.local.datasets
+
+    @classmethod
+    def open(cls, filename, open_options):
+        """
+        Returns the pooled dataset of a file, opening and pooling it when missing.
+        """
+        datasets = cls.datasets()
+        key = (filename, tuple(open_options))
+
+        if datasets is not None and datasets.get(key) is not None:
+            return datasets[key]
+
+        dataset = gdal.OpenEx(filename, open_options=open_options)
+
+        if datasets is not None and dataset is not None:
+            datasets[key] = dataset
+
+        return dataset
+
 
 class InspectorMixin(object):
     """
@@ -77,8 +177,62 @@ class GDALInspector(InspectorMixin):
     def __init__(self, connection_string, *args, **kwargs):
         self.file = connection_string
         self.data = None
+        self.fingerprint = None
         super(GDALInspector, self).__init__(*args, **kwargs)
 
+    def __enter__(self):
+        # The file is opened when it is first needed, describe_fields and file_type may be answered by the cache.
+        return self
+
+    def get_data(self):
+        if not self.data:
+            self.open(*self.args, **self.kwargs)
+
+        return self.data
+
+    def cache_key(self, method, *args):
+        """
+        Returns the key of a cached result for this inspector's file, or None if the file can not be fingerprinted.
+        """
+        if self.fingerprint is None:
+            fingerprint = file_fingerprint(self.file)
+            self.fingerprint = (fingerprint, repr(self.kwargs.get('open_options'))) if fingerprint else False
+
+        if self.fingerprint:
+            return (type(self).__name__, method) + self.fingerprint + args
+
+    def cached(self, method, compute, *args):
+        """
+        Returns the cached result of `method` for this inspector's file, computing and caching it when missing.
+
+        Results are cached along with the path of the file they were computed for, paths in descriptions are
+        rewritten when the same file is inspected in another location (i.e. once moved to the upload directory).
+        """
+        key = self.cache_key(method, *args)
+        cached = DESCRIBE_CACHE.get(key) if key else None
+
+        if cached is not None:
+            path, result = cached
+            return self.relocate(copy.deepcopy(result), path)
+
+        result = compute(*args)
+
+        if key:
+            DESCRIBE_CACHE.set(key, (self.file, copy.deepcopy(result)))
+
+        return result
+
+    def relocate(self, result, path):
+        if path == self.file or not isinstance(result, list):
+            return result
+
+        for description in result:
+            for key in ('path', 'layer_name'):
+                if isinstance(description.get(key), basestring):
+                    description[key] = description[key].replace(path, self.file)
+
+        return result
+
     def close(self, *args, **kwargs):
         self.data = None
 
@@ -127,7 +281,7 @@ class GDALInspector(InspectorMixin):
 
     def open(self, *args, **kwargs):
         """
-        Opens the file.
+        Opens the file, or reuses the dataset opened for it in the active DatasetPool.
         """
         filename = self.file
 
@@ -140,7 +294,7 @@ class GDALInspector(InspectorMixin):
         open_options = kwargs.get('open_options', [])
 
         try:
-            self.data = gdal.OpenEx(filename, open_options=open_options)
+            self.data = DatasetPool.open(filename, open_options)
         except RuntimeError:
             raise NoDataSourceFound
 
@@ -163,15 +317,112 @@ class GDALInspector(InspectorMixin):
         except KeyError:
             return
 
-    def describe_fields(self):
+    @staticmethod
+    def sample_date_formats(layer, fields):
+        """
+        Infers the date format of string fields from the first DATE_SAMPLE_SIZE features of a layer.
+
+        :return: A dict of field names and their `DateFormat.describe()`, or None.
+        """
+        samples = dict((field, []) for field in fields)
+        layer.ResetReading()
+
+        for feature in itertools.islice(iter(layer.GetNextFeature, None), DATE_SAMPLE_SIZE):
+            for field in fields:
+                samples[field].append(feature.GetField(field))
+
+        layer.ResetReading()
+        date_formats = {}
+
+        for field, values in samples.items():
+            date_format = infer_date_format(values)
+            date_formats[field] = date_format.describe() if date_format else None
+
+        return date_formats
+
+    @staticmethod
+    def describe_geometries(layer):
+        """
+        Returns the extent of a layer when the driver knows it without a scan, its EPSG code and the number of
+        geometries of each type in the first GEOMETRY_SAMPLE_SIZE features.
+
+        `multipart` is True if a sampled geometry is a multi-part type, False if none of the layer's geometries is
+        (all features were sampled) and None otherwise.
+        """
+        description = {'extent': None, 'srid': None, 'geometry_types': {}, 'multipart': None}
+
+        try:
+            extent = layer.GetExtent(force=0, can_return_null=True)
+        except RuntimeError:
+            extent = None
+
+        if extent:
+            description['extent'] = list(extent)
+
+        srs = layer.GetSpatialRef()
+
+        if srs is not None:
+            srs = srs.Clone()
+
+            try:
+                if srs.AutoIdentifyEPSG() == 0 and srs.GetAuthorityName(None) == 'EPSG':
+                    description['srid'] = int(srs.GetAuthorityCode(None))
+            except (RuntimeError, TypeError, ValueError):
+                pass
+
+        geometry_types = description['geometry_types']
+        sampled = 0
+        layer.ResetReading()
+
+        for feature in itertools.islice(iter(layer.GetNextFeature, None), GEOMETRY_SAMPLE_SIZE):
+            sampled += 1
+            geometry = feature.GetGeometryRef()
+
+            if geometry is None:
+                continue
+
+            name = GDAL_GEOMETRY_TYPES.get(geometry.GetGeometryType(), geometry.GetGeometryName())
+            geometry_types[name] = geometry_types.get(name, 0) + 1
+
+        layer.ResetReading()
+
+        if any(name.startswith('Multi') or name == 'GeometryCollection' for name in geometry_types):
+            description['multipart'] = True
+        elif sampled < GEOMETRY_SAMPLE_SIZE:
+            description['multipart'] = False
+
+        return description
+
+    def describe_fields(self, infer_date_formats=None, exact_count=True, describe_geometries=None):
         """
         Returns a dict of the layers with fields and field types.
+
+        Descriptions are cached by the fingerprint of the file (see DESCRIBE_CACHE_SIZE), so a file that is
+        inspected several times during an upload, even once moved to the upload directory, is only opened and
+        scanned once.
+
+        :param infer_date_formats: Adds the `date_format` inferred from a sample of the values of string fields,
+        defaults to OSGEO_IMPORTER_INFER_DATE_FORMATS.
+        :param exact_count: When False, the `feature_count` of layers whose driver can't count features without
+        scanning the file (i.e. CSV, GeoJSON, KML) is None, see `feature_count`.
+        :param describe_geometries: Adds the `describe_geometries` of vector layers, defaults to
+        OSGEO_IMPORTER_DESCRIBE_GEOMETRIES.
         """
-        opened_file = self.data
-        description = []
+        if infer_date_formats is None:
+            infer_date_formats = INFER_DATE_FORMATS
 
-        if not opened_file:
-            opened_file = self.open()
+        if describe_geometries is None:
+            describe_geometries = DESCRIBE_GEOMETRIES
+
+        return self.cached('describe_fields', self.describe_layers, infer_date_formats, exact_count,
+                           describe_geometries)
+
+    def describe_layers(self, infer_date_formats, exact_count=True, describe_geometries=False):
+        """
+        Opens the file and describes its layers, see `describe_fields`.
+        """
+        opened_file = self.get_data()
+        description = []
         driver = opened_file.GetDriver().ShortName
 
         # Get Vector Layers
@@ -188,7 +439,9 @@ class GDALInspector(InspectorMixin):
                                  'driver': driver,
                                  'layer_definition': None}
             if driver != 'WFS':
-                layer_description['feature_count'] = layer.GetFeatureCount()
+                if exact_count or layer.TestCapability(ogr.OLCFastFeatureCount):
+                    layer_description['feature_count'] = layer.GetFeatureCount()
+
                 layer_definition = layer.GetLayerDefn()
 
                 for i in range(layer_definition.GetFieldCount()):
@@ -198,6 +451,18 @@ class GDALInspector(InspectorMixin):
                     field_desc['type'] = field.GetFieldTypeName(i)
                     layer_description['fields'].append(field_desc)
 
+                if infer_date_formats:
+                    string_fields = [described['name'] for described in layer_description['fields']
+                                     if described['type'] == 'String']
+                    date_formats = self.sample_date_formats(layer, string_fields) if string_fields else {}
+
+                    for field_desc in layer_description['fields']:
+                        if field_desc['name'] in date_formats:
+                            field_desc['date_format'] = date_formats[field_desc['name']]
+
+                if describe_geometries:
+                    layer_description.update(self.describe_geometries(layer))
+
             description.append(layer_description)
 
         # Get Raster Layers
@@ -210,38 +475,84 @@ class GDALInspector(InspectorMixin):
                                  'driver': driver}
             description.append(layer_description)
 
-        # Get sub layers
-        raster_list = opened_file.GetSubDatasets()
-        for m in range(0, raster_list.__len__()):
-            layer = gdal.OpenEx(raster_list[m][0])
+        # Get sub layers, they are opened by path when imported
+        subdatasets = []
+        for m, (path, subdataset_description) in enumerate(opened_file.GetSubDatasets()):
             layer_description = {'index': len(description),
                                  'subdataset_index': m,
-                                 'path': raster_list[m][0],
-                                 'layer_name': raster_list[m][0].split(':')[-1],
+                                 'path': path,
+                                 'layer_name': path.split(':')[-1],
+                                 'description': subdataset_description,
                                  'raster': True, 'driver': driver}
             description.append(layer_description)
+            subdatasets.append(layer_description)
+
+        if subdatasets and SUBDATASET_METADATA_THREADS:
+            self.describe_subdatasets(subdatasets, SUBDATASET_METADATA_THREADS)
 
         return description
 
+    @staticmethod
+    def subdataset_metadata(path):
+        """
+        Returns the size, band count and SRS of a raster, or an empty dict if it can't be opened.
+        """
+        try:
+            dataset = gdal.OpenEx(path, gdal.OF_RASTER)
+        except RuntimeError:
+            dataset = None
+
+        if dataset is None:
+            return {}
+
+        metadata = {'size': [dataset.RasterXSize, dataset.RasterYSize],
+                    'bands': dataset.RasterCount,
+                    'srs': dataset.GetProjection() or None}
+
+        # Close the dataset.
+        dataset = None
+        return metadata
+
+    def describe_subdatasets(self, subdatasets, threads):
+        """
+        Adds the `subdataset_metadata` of each subdataset description, opening up to `threads` subdatasets at once.
+        """
+        pool = ThreadPool(min(threads, len(subdatasets)))
+
+        try:
+            metadata = pool.map(self.subdataset_metadata, [subdataset['path'] for subdataset in subdatasets])
+        finally:
+            pool.close()
+            pool.join()
+
+        for subdataset, subdataset_metadata in zip(subdatasets, metadata):
+            subdataset.update(subdataset_metadata)
+
     def get_driver(self):
-        opened_file = self.data
+        return self.get_data().GetDriver()
 
-        if not opened_file:
-            opened_file = self.open()
+    def feature_count(self, index):
+        """
+        Returns the number of features of a vector layer, scanning the file if the driver can't count them quickly.
+        None if the file has no vector layer at that index.
+        """
+        def count(index):
+            layer = self.get_data().GetLayer(index)
+            return layer.GetFeatureCount() if layer is not None else None
 
-        return opened_file.GetDriver()
+        return self.cached('feature_count', count, index)
 
     def file_type(self):
         """
         Returns the data's file type (via the GDAL driver name)
         """
-        return self.get_driver().ShortName
+        return self.cached('file_type', lambda: self.get_driver().ShortName)
 
 
 class OGRTruncatedConverter(OGRInspector):
     def convert_truncated(self, source_layer_name, dest_layer_name):
         converted_mapping = {}
-        dest_layer_name = dest_layer_name.split(':')[1]
+        dest_layer_name = dest_layer_name.split(':')[-1]
         dest_layer = self.data.GetLayerByName(dest_layer_name)
         source_layer = self.data.GetLayerByName(source_layer_name)
         dest_schema = dest_layer.GetLayerDefn()
@@ -325,44 +636,82 @@ class OGRTruncatedConverter(OGRInspector):
         return field_schema
 
 
-class BigDateOGRFieldConverter(OGRInspector):
+class StreamConverterMixin(object):
+    """
+    Lets the importer compute the columns of a field converter while the features are first written to the target
+    layer (see `StreamConverter`), instead of rewriting the table once it is loaded.
+    """
 
-    def convert_field(self, layer_name, field):
-        field_as_string = str(field)
-        xd_col = '{0}_xd'.format(field).lower()
-        parsed_col = '{0}_parsed'.format(field).lower()
-        target_layer = self.data.GetLayerByName(layer_name)
+    # (column name template, OGR field type) of the columns added for each converted field.
+    stream_columns = []
 
-        # target_layer.GetLayerDefn().GetFieldIndex(parsed_col) raises errors when the field does not
-        # exist with older versions of OGR
-        while target_layer.FindFieldIndex(xd_col, 1) >= 0:
-            xd_col = increment(xd_col)
+    @classmethod
+    def create_stream_columns(cls, target_layer, field):
+        """
+        Adds the columns of a converted field to a target layer that has not been loaded yet.
 
-        while target_layer.FindFieldIndex(parsed_col, 1) >= 0:
-            parsed_col = increment(parsed_col)
+        :return: The names of the new columns, as laundered by OGR.
+        """
+        names = []
 
-        target_layer.CreateField(ogr.FieldDefn(xd_col, ogr.OFTInteger64))
-        xd_col_index = target_layer.GetLayerDefn().GetFieldIndex(xd_col)
-        target_layer.CreateField(ogr.FieldDefn(parsed_col, ogr.OFTString))
-        parsed_col_index = target_layer.GetLayerDefn().GetFieldIndex(parsed_col)
+        for template, field_type in cls.stream_columns:
+            name = template.format(field).lower()
 
-        for feat in target_layer:
+            while target_layer.FindFieldIndex(name, 1) >= 0:
+                name = increment(name)
 
-            if not feat:
-                continue
+            target_layer.CreateField(ogr.FieldDefn(name, field_type))
+            layer_definition = target_layer.GetLayerDefn()
+            names.append(layer_definition.GetFieldDefn(layer_definition.GetFieldCount() - 1).GetName())
 
-            string_field = feat[field_as_string]
+        return names
 
-            if string_field:
-                xd, parsed = timeparse(str(string_field))
+    @staticmethod
+    def parse_value(value, date_format=None):
+        """
+        Returns the values of the stream columns for a single source value.
 
-                feat.SetField(xd_col_index, xd)
-                feat.SetField(parsed_col_index, parsed)
+        :param date_format: The DateFormat inferred for the field, tried before the generic parser.
+        """
+        raise NotImplementedError
 
-                target_layer.SetFeature(feat)
+    @classmethod
+    def finish_stream(cls, layer_name, columns):
+        """
+        A hook called once a layer with stream columns is loaded.
 
-            # prevent segfaults
-            feat = None
+        :param columns: A list of (source field, [column names]) pairs.
+        """
+        pass
+
+
+class BigDateOGRFieldConverter(StreamConverterMixin, OGRInspector):
+    """
+    Converts dates to milliseconds since the epoch (`<field>_xd`, a bigdate column) and ISO 8601 strings
+    (`<field>_parsed`), supporting dates outside of the range of PostgreSQL's timestamps.
+    """
+
+    batch_size = 10000
+    stream_columns = [('{0}_xd', ogr.OFTInteger64), ('{0}_parsed', ogr.OFTString)]
+
+    @staticmethod
+    def parse_value(value, date_format=None):
+        xd, parsed = date_format.timeparse(value) if date_format else (None, None)
+
+        if xd is None:
+            xd, parsed = timeparse(value)
+
+        return [int(xd) if xd is not None else None, parsed]
+
+    @classmethod
+    def finish_stream(cls, layer_name, columns):
+        cls.use_bigdate(layer_name, [names[0] for _, names in columns])
+
+    @staticmethod
+    def use_bigdate(layer_name, xd_cols):
+        """
+        Changes the type of `_xd` columns to the bigdate domain, creating it when needed.
+        """
         conn = db.connections[settings.OSGEO_DATASTORE]
         cursor = conn.cursor()
         query = """
@@ -374,44 +723,359 @@ class BigDateOGRFieldConverter(OGRInspector):
         END;
         $$;
 
-        ALTER TABLE %s ALTER COLUMN %s TYPE bigdate;
-        """ % (quote_ident(layer_name), quote_ident(xd_col))
+        ALTER TABLE %s %s;
+        """ % (quote_ident(layer_name), ', '.join('ALTER COLUMN %s TYPE bigdate' % quote_ident(xd_col)
+                                                  for xd_col in xd_cols))
 
         cursor.execute(query)
 
-        return xd_col
+    def convert_field(self, layer_name, field):
+        return self.convert_fields(layer_name, [field])[field]
+
+    def convert_fields(self, layer_name, fields):
+        """
+        Converts many fields of a layer at once.
+
+        :return: A dict of the converted fields and the names of their `_xd` columns.
+        """
+        target_layer = self.data.GetLayerByName(layer_name)
+        columns = []
+
+        for field in fields:
+            if target_layer.FindFieldIndex(str(field), 1) < 0:
+                logger.warning('Unable to convert {0}, the layer has no such field.'.format(field))
+                continue
+
+            xd_col = '{0}_xd'.format(field).lower()
+            parsed_col = '{0}_parsed'.format(field).lower()
+
+            # target_layer.GetLayerDefn().GetFieldIndex(parsed_col) raises errors when the field does not
+            # exist with older versions of OGR
+            while target_layer.FindFieldIndex(xd_col, 1) >= 0:
+                xd_col = increment(xd_col)
+
+            while target_layer.FindFieldIndex(parsed_col, 1) >= 0:
+                parsed_col = increment(parsed_col)
 
+            target_layer.CreateField(ogr.FieldDefn(xd_col, ogr.OFTInteger64))
+            target_layer.CreateField(ogr.FieldDefn(parsed_col, ogr.OFTString))
+            columns.append((str(field), xd_col, parsed_col))
 
-class OGRFieldConverter(OGRInspector):
+        if not columns:
+            return {}
+
+        self.write_parsed_values(layer_name, columns)
+        self.use_bigdate(layer_name, [column[1] for column in columns])
+
+        return dict((column[0], column[1]) for column in columns)
+
+    def write_parsed_values(self, layer_name, columns):
+        """
+        Parses the distinct values of each field with `timeparse_many` into a temporary table and fills the
+        `_xd` and `_parsed` columns of all fields with a single UPDATE.
+
+        :param columns: A list of (field, xd column, parsed column) tuples.
+        """
+        table = quote_ident(layer_name)
+        values_table = 'bigdate_{0}'.format(uuid.uuid4().hex)
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+        rows = []
+
+        for i, (field, _, _) in enumerate(columns):
+            cursor.execute('SELECT DISTINCT {0}::text FROM {1} WHERE {0} IS NOT NULL'.format(quote_ident(field),
+                                                                                            table))
+            values = [row[0] for row in cursor.fetchall() if row[0]]
+
+            if values:
+                xds, parsed = timeparse_many(values, infer_date_format(values))
+                rows.extend((i, value, xd, iso) for value, xd, iso in zip(values, xds.tolist(), parsed)
+                            if xd is not None)
+
+        if not rows:
+            return
+
+        assignments = []
+        conditions = []
+
+        for i, (field, xd_col, parsed_col) in enumerate(columns):
+            lookup = '(SELECT {{0}} FROM {0} v WHERE v.field = {1} AND v.value = {2}.{3}::text)'.format(
+                values_table, i, table, quote_ident(field))
+            assignments.append('{0} = {1}'.format(quote_ident(xd_col), lookup.format('xd')))
+            assignments.append('{0} = {1}'.format(quote_ident(parsed_col), lookup.format('parsed')))
+            conditions.append('{0} IS NOT NULL'.format(quote_ident(field)))
+
+        with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+            cursor.execute('CREATE TEMPORARY TABLE {0} (field integer, value text, xd bigint, parsed text, '
+                           'PRIMARY KEY (field, value)) ON COMMIT DROP'.format(values_table))
+
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                cursor.execute('INSERT INTO {0} VALUES {1}'.format(values_table,
+                                                                   ', '.join(['(%s, %s, %s, %s)'] * len(batch))),
+                               [item for row in batch for item in row])
+
+            cursor.execute('ANALYZE {0}'.format(values_table))
+            cursor.execute('UPDATE {0} SET {1} WHERE {2}'.format(table, ', '.join(assignments),
+                                                                 ' OR '.join(conditions)))
+
+
+class OGRFieldConverter(StreamConverterMixin, OGRInspector):
     """
     Uses dateutil.parse to parse date times.
     """
 
+    stream_columns = [('{0}_as_date', ogr.OFTDateTime)]
+
+    @staticmethod
+    def parse_value(value, date_format=None):
+        parsed = date_format.parse(value) if date_format else None
+
+        if parsed is not None:
+            return [parsed]
+
+        try:
+            return [parse(value).replace(tzinfo=None)]
+        except (ValueError, OverflowError):
+            logger.warning('Unable to parse {0!r} as a date.'.format(value))
+            return [None]
+
     def convert_field(self, layer_name, field):
-        fieldname = '{0}_as_date'.format(field)
-        target_layer = self.data.GetLayerByName(layer_name)
+        return self.convert_fields(layer_name, [field])[field]
 
-        while target_layer.GetLayerDefn().GetFieldIndex(fieldname) >= 0:
-            fieldname = increment(fieldname)
+    @staticmethod
+    def create_date_fields(target_layer, fields):
+        """
+        Adds a `<field>_as_date` column for each field of the layer, fields it doesn't have are skipped.
 
-        target_layer.CreateField(ogr.FieldDefn(fieldname, ogr.OFTDateTime))
-        field_index = target_layer.GetLayerDefn().GetFieldIndex(fieldname)
+        :return: A list of (field, column name) tuples, using the column names as laundered by OGR.
+        """
+        columns = []
+
+        for field in fields:
+            if target_layer.GetLayerDefn().GetFieldIndex(str(field)) < 0:
+                logger.warning('Unable to convert {0}, the layer has no such field.'.format(field))
+                continue
+
+            fieldname = '{0}_as_date'.format(field)
+
+            while target_layer.GetLayerDefn().GetFieldIndex(fieldname) >= 0:
+                fieldname = increment(fieldname)
+
+            target_layer.CreateField(ogr.FieldDefn(fieldname, ogr.OFTDateTime))
+            layer_definition = target_layer.GetLayerDefn()
+            columns.append((field, layer_definition.GetFieldDefn(layer_definition.GetFieldCount() - 1).GetName()))
+
+        return columns
+
+    def convert_fields(self, layer_name, fields):
+        """
+        Converts many fields of a layer in a single pass over its features.
+
+        :return: A dict of the converted fields and the names of their new date columns.
+        """
+        target_layer = self.data.GetLayerByName(layer_name)
+        columns = self.create_date_fields(target_layer, fields)
+        layer_definition = target_layer.GetLayerDefn()
+        indexes = [(str(field), layer_definition.GetFieldIndex(fieldname)) for field, fieldname in columns]
 
         for feat in target_layer:
 
             if not feat:
                 continue
 
-            string_field = feat[str(field)]
+            modified = False
 
-            if string_field:
-                pars = parse(str(string_field))
+            for field, field_index in indexes:
+                string_field = feat[field]
 
-                feat.SetField(field_index, pars.year, pars.month, pars.day, pars.hour, pars.minute, pars.second,
-                              pars.microsecond)
+                if string_field:
+                    # Values that can't be parsed are left empty instead of failing every field.
+                    pars = self.parse_value(str(string_field))[0]
 
+                    if pars is not None:
+                        feat.SetField(field_index, pars.year, pars.month, pars.day, pars.hour, pars.minute,
+                                      pars.second, pars.microsecond)
+                        modified = True
+
+            if modified:
                 target_layer.SetFeature(feat)
 
             feat = None
 
-        return fieldname
+        return dict(columns)
+
+
+class PostGISFieldConverter(OGRFieldConverter):
+    """
+    Converts date fields of PostGIS layers with a set-based UPDATE. Values in the formats of SQL_FORMATS are cast by
+    PostgreSQL, dateutil.parse only handles the remaining values, `batch_size` rows at a time.
+    """
+
+    batch_size = 10000
+
+    # (regular expression, SQL expression) pairs, `{0}` is replaced by the text value of the field.
+    SQL_FORMATS = [
+        (r'^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$', '{0}::timestamp'),
+        (r'^\d{4}/\d{2}/\d{2}$', "to_timestamp({0}, 'YYYY/MM/DD')"),
+        (r'^\d{8}$', "to_timestamp({0}, 'YYYYMMDD')"),
+    ]
+
+    def convert_fields(self, layer_name, fields):
+        """
+        Converts many fields of a layer with a single UPDATE, then parses the values SQL could not convert in a
+        single scan of the table.
+        """
+        if self.data.GetDriver().GetName() != 'PostgreSQL':
+            return super(PostGISFieldConverter, self).convert_fields(layer_name, fields)
+
+        target_layer = self.data.GetLayerByName(layer_name)
+        date_columns = self.create_date_fields(target_layer, fields)
+        table, fid = quote_ident(layer_name), quote_ident(target_layer.GetFIDColumn())
+        columns = [('btrim({0}::text)'.format(quote_ident(field)), quote_ident(fieldname))
+                   for field, fieldname in date_columns]
+
+        if not columns:
+            return {}
+
+        patterns = '|'.join('({0})'.format(pattern) for pattern, _ in self.SQL_FORMATS)
+        cursor = db.connections[settings.OSGEO_DATASTORE].cursor()
+
+        def sql_update(update_columns):
+            assignments = ', '.join('{0} = CASE {1} END'.format(target, ' '.join(
+                "WHEN {0} ~ '{1}' THEN {2}".format(value, pattern, expression.format(value))
+                for pattern, expression in self.SQL_FORMATS)) for value, target in update_columns)
+            conditions = ' OR '.join("{0} ~ '{1}'".format(value, patterns) for value, _ in update_columns)
+
+            with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+                cursor.execute('UPDATE {0} SET {1} WHERE {2}'.format(table, assignments, conditions))
+
+        # Values that match a pattern but are not valid dates (i.e. 2001-02-30) make the cast fail, the fields are
+        # then cast one at a time and the fields that still fail are converted by dateutil.
+        try:
+            sql_update(columns)
+        except db.DataError:
+            for column in columns:
+                try:
+                    sql_update([column])
+                except db.DataError:
+                    logger.warning('Unable to convert {0}.{1} in SQL, parsing all values.'.format(layer_name,
+                                                                                                 column[0]))
+
+        date_formats = [self.convert_inferred_format(table, value, target, cursor) for value, target in columns]
+        self.parse_remaining(table, fid, columns, cursor, date_formats)
+        return dict(date_columns)
+
+    @staticmethod
+    def convert_inferred_format(table, value, target, cursor):
+        """
+        Infers the format of the values SQL_FORMATS did not match from a sample and, when it can be translated to a
+        to_timestamp pattern, converts the matching values with another UPDATE.
+
+        :return: The inferred DateFormat, or None.
+        """
+        cursor.execute("SELECT {0} FROM {1} WHERE {2} IS NULL AND {0} <> '' LIMIT %s".format(value, table, target),
+                       [DATE_SAMPLE_SIZE])
+        date_format = infer_date_format([row[0] for row in cursor.fetchall()])
+
+        if date_format is None or date_format.sql is None:
+            return date_format
+
+        regex, pattern = date_format.sql
+
+        try:
+            with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+                cursor.execute('UPDATE {0} SET {1} = to_timestamp({2}, %s) WHERE {1} IS NULL AND {2} ~ %s'.format(
+                    table, target, value), [pattern, regex])
+        except db.DataError:
+            logger.warning('Unable to convert {0} with the format {1} in SQL.'.format(value, date_format.format))
+
+        return date_format
+
+    def parse_remaining(self, table, fid, columns, cursor, date_formats=None):
+        """
+        Parses the values of the rows SQL could not convert with dateutil, `batch_size` rows at a time.
+
+        :param columns: A list of (source value expression, quoted target column) tuples.
+        :param date_formats: The DateFormat (or None) of each column, tried before dateutil.
+        """
+        date_formats = date_formats or [None] * len(columns)
+        selects = ', '.join("CASE WHEN {1} IS NULL AND {0} <> '' THEN {0} END".format(value, target)
+                            for value, target in columns)
+        conditions = ' OR '.join("({1} IS NULL AND {0} <> '')".format(value, target) for value, target in columns)
+        assignments = ', '.join('{1} = coalesce(v.value{0}, {2}.{1})'.format(i, target, table)
+                                for i, (_, target) in enumerate(columns))
+        names = ', '.join('value{0}'.format(i) for i in range(len(columns)))
+        placeholders = '({0})'.format(', '.join(['%s'] + ['%s::timestamp'] * len(columns)))
+        last_fid = None
+
+        while True:
+            cursor.execute('SELECT {0}, {1} FROM {2} WHERE ({3}) {4}ORDER BY {0} LIMIT %s'.format(
+                fid, selects, table, conditions, 'AND {0} > %s '.format(fid) if last_fid is not None else ''),
+                ([last_fid] if last_fid is not None else []) + [self.batch_size])
+            rows = cursor.fetchall()
+
+            if not rows:
+                break
+
+            last_fid = rows[-1][0]
+            values = []
+
+            for row in rows:
+                parsed = []
+
+                for string_field, date_format in zip(row[1:], date_formats):
+                    parsed.append(self.parse_value(string_field, date_format)[0] if string_field else None)
+
+                if any(parsed):
+                    values.append([row[0]] + parsed)
+
+            if values:
+                cursor.execute('UPDATE {0} SET {1} FROM (VALUES {2}) AS v(fid, {3}) WHERE {0}.{4} = v.fid'.format(
+                    table, assignments, ', '.join([placeholders] * len(values)), names, fid),
+                    [item for row in values for item in row])
+
+
+class StreamConverter(object):
+    """
+    Computes the stream columns of a field converter (see `StreamConverterMixin`) from source features, caching the
+    results of repeated values.
+
+    :param field_converter: The field converter class.
+    :param columns: A list of (source field, [column names]) pairs.
+    :param date_formats: A dict of source fields and the DateFormat of their values.
+    """
+
+    cache_size = 100000
+
+    def __init__(self, field_converter, columns, date_formats=None):
+        self.field_converter = field_converter
+        self.columns = columns
+        self.date_formats = date_formats or {}
+        self.cache = {}
+
+    @property
+    def names(self):
+        return [name for _, names in self.columns for name in names]
+
+    def values(self, feature):
+        """
+        Returns the values of all stream columns for a source feature, in the order of `names`.
+        """
+        values = []
+
+        for field, names in self.columns:
+            value = feature.GetField(str(field))
+            value = str(value) if value else None
+
+            key = (field, value)
+
+            if key not in self.cache:
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+
+                self.cache[key] = (self.field_converter.parse_value(value, self.date_formats.get(field)) if value
+                                   else [None] * len(names))
+
+            values.extend(self.cache[key])
+
+        return values
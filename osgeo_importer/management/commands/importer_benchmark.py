@@ -0,0 +1,43 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from osgeo_importer.benchmarks import BENCHMARKS, FORMATS, GEOMETRY_TYPES
+
+
+class Command(BaseCommand):
+    help = 'Runs importer benchmarks against the configured OSGEO_DATASTORE and prints the results as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run: {0}.'.format(', '.join(BENCHMARKS)))
+        parser.add_argument('--count', type=int, help='Number of synthetic features to generate.')
+        parser.add_argument('--fields', help='Comma separated field types of the generated layers, '
+                                             'e.g. integer,real,string,date.')
+        parser.add_argument('--formats', help='Comma separated vector formats to generate: {0}.'.format(
+            ', '.join(sorted(FORMATS))))
+        parser.add_argument('--geometry-types', help='Comma separated geometry types to generate: {0}.'.format(
+            ', '.join(sorted(GEOMETRY_TYPES))))
+        parser.add_argument('--raster-size', type=int, help='Width and height of the generated GeoTIFF.')
+        parser.add_argument('--output', help='Writes the JSON results to a file.')
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or sorted(BENCHMARKS)
+        kwargs = {}
+
+        for option in ('count', 'fields', 'formats', 'geometry_types', 'raster_size'):
+            if options.get(option):
+                kwargs[option] = options[option]
+
+        results = {}
+        for name in names:
+            if name not in BENCHMARKS:
+                raise CommandError('Unknown benchmark: {0}'.format(name))
+            results[name] = BENCHMARKS[name](**kwargs)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                f.write(output)
+
+        self.stdout.write(output)
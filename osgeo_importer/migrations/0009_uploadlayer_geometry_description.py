@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osgeo_importer', '0008_uploadlayer_import_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadlayer',
+            name='extent',
+            field=jsonfield.fields.JSONField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadlayer',
+            name='srid',
+            field=models.IntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadlayer',
+            name='geometry_types',
+            field=jsonfield.fields.JSONField(null=True, blank=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('osgeo_importer', '0009_uploadlayer_geometry_description'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='uploadeddata',
+            name='size',
+            field=models.BigIntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadeddata',
+            name='offset',
+            field=models.BigIntegerField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='uploadeddata',
+            name='checksum',
+            field=models.CharField(max_length=8, null=True, blank=True),
+        ),
+    ]
@@ -28,6 +28,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
 from djcelery.models import TaskState
 from jsonfield import JSONField
 
@@ -74,6 +76,21 @@ def validate_file_type(value):
         return
 
 
+def write_upload(value, filename):
+    """
+    Links a file uploaded to a temporary file to `filename`, or writes it there when it is only held in memory.
+    """
+    temporary_file_path = getattr(getattr(value, 'file', value), 'temporary_file_path', None)
+
+    if temporary_file_path:
+        os.symlink(temporary_file_path(), filename)
+        return
+
+    with open(filename, 'wb') as f:
+        for chunk in value.chunks():
+            f.write(chunk)
+
+
 def validate_inspector_can_read(value):
     """
     Validates Geospatial data.
@@ -88,9 +105,7 @@ def validate_inspector_can_read(value):
         return
 
     if extension in ['tif']:
-        with open(filename, 'wb') as f:
-            for chunk in value.chunks():
-                f.write(chunk)
+        write_upload(value, filename)
 
         try:
             importer = load_handler(OSGEO_IMPORTER, filename)
@@ -105,15 +120,13 @@ def validate_inspector_can_read(value):
         return
 
     #  Otherwise check if vector
-    with open(filename, 'wb') as f:
-        for chunk in value.chunks():
-            f.write(chunk)
+    write_upload(value, filename)
 
     try:
         importer = load_handler(OSGEO_IMPORTER, filename)
         data, inspector = importer.open_source_datastore(filename)
         # Ensure the data has a geometry.
-        for description in inspector.describe_fields():
+        for description in inspector.describe_fields(exact_count=False):
             if description.get('geom_type') in inspector.INVALID_GEOMETRY_TYPES:
                 raise ValidationError('Unable to find geometry or the geometry type is unsupported.')
 
@@ -132,15 +145,21 @@ class UploadedData(models.Model):
     upload_dir = models.CharField(max_length=1000, null=True)
     name = models.CharField(max_length=64, null=True)
     complete = models.BooleanField(default=False)
-    size = models.IntegerField(null=True, blank=True)
+    size = models.BigIntegerField(null=True, blank=True)
     metadata = models.TextField(null=True)
     file_type = models.CharField(max_length=50, null=True, blank=True)
+    # Bytes received and their CRC-32 (hex) for uploads sent in chunks, see UploadedFileResource.
+    offset = models.BigIntegerField(null=True, blank=True)
+    checksum = models.CharField(max_length=8, null=True, blank=True)
 
     class Meta:
         ordering = ['-date']
         verbose_name_plural = 'Upload data'
 
     STATE_INVALID = 'INVALID'
+    STATE_UPLOADING = 'UPLOADING'
+    STATE_UPLOADED = 'UPLOADED'
+    STATE_INSPECTED = 'INSPECTED'
 
     def get_delete_url(self):
         return reverse('data_upload_delete', args=[self.id])
@@ -181,6 +200,8 @@ class UploadFile(models.Model):
     )
     file_type = models.CharField(max_length=50, null=True, blank=True)
     slug = models.SlugField(max_length=250, blank=True)
+    # SHA-256 of the file, which is a link to the blob of that hash, see osgeo_importer.blobs.
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
     def __unicode__(self):
         return self.slug
@@ -197,6 +218,31 @@ class UploadFile(models.Model):
         self.file.delete(False)
         super(UploadFile, self).delete(*args, **kwargs)
 
+        if self.content_hash:
+            from .blobs import release
+            release(self.content_hash)
+
+
+@receiver(pre_delete, sender=UploadedData)
+def collect_upload_files(sender, instance, **kwargs):
+    """
+    Remembers the directories and content hashes of the files of an upload that is deleted, see remove_upload_files.
+    """
+    upfiles = instance.uploadfile_set.exclude(file='')
+    instance.upload_paths = set(os.path.dirname(upfile.file.path) for upfile in upfiles)
+    instance.content_hashes = [upfile.content_hash for upfile in upfiles if upfile.content_hash]
+
+
+@receiver(post_delete, sender=UploadedData)
+def remove_upload_files(sender, instance, **kwargs):
+    """
+    Removes the files of a deleted upload and releases their blobs once their rows were deleted along with it.
+    """
+    from .tasks import remove_path
+
+    for path in getattr(instance, 'upload_paths', []):
+        remove_path.delay(path, instance.content_hashes)
+
 
 class UploadLayer(models.Model):
     """Layers stored in an uploaded data set.
@@ -214,6 +260,11 @@ class UploadLayer(models.Model):
     task_id = models.CharField(max_length=36, blank=True, null=True)
     feature_count = models.IntegerField(null=True, blank=True)
     layer_name = models.CharField(max_length=64, null=True)
+    extent = JSONField(null=True, blank=True)
+    srid = models.IntegerField(null=True, blank=True)
+    geometry_types = JSONField(null=True, blank=True)
+    multipart = models.NullBooleanField()
+    raster = models.BooleanField(default=False)
 
     @property
     def file_name(self):
@@ -1,9 +1,12 @@
 import os
 import shutil
-from .models import UploadFile
+from . import blobs
+from .inspectors import DatasetPool
+from .models import UploadedData, UploadFile, UploadLayer
 from celery.task import task
 
-from .views import OSGEO_IMPORTER
+from .utils import NoDataSourceFound
+from .views import OSGEO_IMPORTER, OSGEO_INSPECTOR, ImportHelper
 
 
 @task
@@ -16,14 +19,58 @@ def import_object(upload_file_id, configuration_options):
 
     upload_file = UploadFile.objects.get(id=upload_file_id)
 
-    gi = OSGEO_IMPORTER(upload_file.file.path, upload_file=upload_file)
-    return gi.handle(configuration_options=configuration_options)
+    with DatasetPool():
+        gi = OSGEO_IMPORTER(upload_file.file.path, upload_file=upload_file)
+        return gi.handle(configuration_options=configuration_options)
 
 
 @task
-def remove_path(path):
+def inspect_upload(upload_id):
     """
-    Removes a path using shutil.rmtree.
+    Creates the upload layers of an upload saved with OSGEO_IMPORTER_ASYNC_INSPECTION, then marks it as inspected.
+    """
+    upload = UploadedData.objects.get(id=upload_id)
+    upfiles = list(upload.uploadfile_set.order_by('id'))
+
+    try:
+        ImportHelper().inspect_upload_files(upload, upfiles)
+    except NoDataSourceFound:
+        UploadedData.objects.filter(id=upload_id).update(state=UploadedData.STATE_INVALID)
+        raise
+
+    # Only update the state and file type, the upload may be changed in the meantime.
+    updates = {'state': UploadedData.STATE_INSPECTED}
+
+    # Uploads named after a single file have its file type, see FileAddView.upload.
+    if upload.file_type is None:
+        updates['file_type'] = next((upfile.file_type for upfile in upfiles
+                                     if os.path.basename(upfile.file.name) == upload.name), None)
+
+    UploadedData.objects.filter(id=upload_id).update(**updates)
+
+
+@task
+def count_features(upload_layer_id):
+    """
+    Stores the number of features of an uploaded layer that could not be counted quickly during the upload.
+    """
+    upload_layer = UploadLayer.objects.get(id=upload_layer_id)
+
+    with OSGEO_INSPECTOR(upload_layer.upload_file.file.path) as inspector:
+        feature_count = inspector.feature_count(upload_layer.index)
+
+    # Only update the count, the layer may be configured in the meantime.
+    UploadLayer.objects.filter(id=upload_layer_id).update(feature_count=feature_count)
+
+
+@task
+def remove_path(path, content_hashes=None):
+    """
+    Removes a path using shutil.rmtree, then the blobs of `content_hashes` (those of the upload files in the path)
+    that are no longer used.
     """
     if os.path.exists(path):
         shutil.rmtree(path)
+
+    for digest in set(content_hashes or []):
+        blobs.release(digest)
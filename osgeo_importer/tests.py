@@ -2,11 +2,18 @@
 # (see test_utf8 for the reason why this file needs a coding cookie)
 
 import os
+import shutil
+import tempfile
 import json
 import unittest
+import zlib
 import logging
+import billiard
+from zipfile import ZipFile
 
 import osgeo
+import osgeo.ogr
+import osgeo.osr
 import gdal
 from django import db
 from django.test import TestCase, Client
@@ -15,8 +22,11 @@ from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
 from django.contrib.auth import get_user_model
 from django.contrib.gis.gdal import DataSource
+from osgeo_importer.handlers import FieldConverterHandler
 from osgeo_importer.handlers.geoserver import configure_time
-from osgeo_importer.inspectors import GDALInspector
+from osgeo_importer import blobs, validators
+from osgeo_importer.forms import ZipMember, validate_files
+from osgeo_importer.inspectors import DatasetPool, GDALInspector, OGRFieldConverter, PostGISFieldConverter
 from geoserver.catalog import Catalog, FailedRequestError
 from geonode.layers.models import Layer
 from geonode.geoserver.helpers import ogc_server_settings
@@ -24,10 +34,15 @@ from osgeo_importer.models import (
     UploadedData, UploadFile, UploadLayer,
     validate_file_extension, ValidationError, validate_inspector_can_read
 )
-from osgeo_importer.handlers.geoserver import GeoWebCacheHandler
-from osgeo_importer.importers import OSGEO_IMPORTER, OGRImport
+from osgeo_importer.handlers.geonode import GeoNodeMetadataHandler
+from osgeo_importer.handlers.geoserver import (
+    GenericSLDHandler, GeoServerBoundsHandler, GeoServerStyleHandler, GeoServerTimeHandler, GeoWebCacheHandler
+)
+from osgeo_importer.importers import MEDIA_ROOT, OSGEO_IMPORTER, OGRImport
+from osgeo_importer.tasks import inspect_upload, remove_path
+from osgeo_importer.writers import OGRFeatureWriter, PostGISCopyWriter
 
-from .utils import load_handler, launder
+from .utils import load_handler, launder, timeparse, timeparse_many, infer_date_format
 
 # In normal unittest runs, this will be set in setUpModule; set here for the
 # benefit of static analysis and users importing this instead of running tests.
@@ -1389,5 +1404,673 @@ class UploaderTests(TestCase):
                 }
             )
 
+    def test_batched_import(self):
+        """Tests that features written in small transactional batches all reach the target.
+        """
+        path = test_file('boxes_with_date.shp')
+        layer = self.generic_import(path, configs=[{'index': 0, 'batch_size': 2}])
+        ogr = OGRImport(path)
+        datastore, _ = ogr.open_target_datastore(ogr.target_store)
+        target_layer = datastore.GetLayerByName(layer.name)
+        self.assertEqual(target_layer.GetFeatureCount(), DataSource(path)[0].num_feat)
+
+    def test_batch_fails_on_commit(self):
+        """Tests that a batch whose rows are only rejected when the COPY ends on commit is retried feature by feature.
+        """
+        ogr = OGRImport(test_file('boxes_with_date.shp'))
+        datastore, _ = ogr.open_target_datastore(ogr.target_store)
+        target_layer = datastore.CreateLayer('batch_commit', geom_type=osgeo.ogr.wkbNone)
+        target_layer.CreateField(osgeo.ogr.FieldDefn('value', osgeo.ogr.OFTInteger))
+        target_layer.SyncToDisk()
+        cursor = self.postgis.cursor()
+
+        try:
+            cursor.execute('ALTER TABLE batch_commit ADD CONSTRAINT batch_commit_value CHECK (value <> 3)')
+            features = []
+
+            for value in range(5):
+                feature = osgeo.ogr.Feature(target_layer.GetLayerDefn())
+                feature.SetField('value', value)
+                features.append(feature)
+
+            with self.assertRaises(RuntimeError):
+                OGRFeatureWriter(target_layer, batch_size=5).write(features)
+
+            # The batch was rolled back, then written one feature at a time up to the bad one.
+            cursor.execute('SELECT value FROM batch_commit ORDER BY value')
+            self.assertEqual([row[0] for row in cursor.fetchall()], [0, 1, 2])
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS batch_commit')
+
+    def test_copy_writer(self):
+        """Tests importing through the PostGIS COPY writer.
+        """
+        path = test_file('china_provinces.shp')
+        ogr = OGRImport(path)
+        ogr.writer = 'osgeo_importer.writers.PostGISCopyWriter'
+        layer_name = ogr.import_file(configuration_options=[{'index': 0}])[0][0]
+        datastore, _ = ogr.open_target_datastore(ogr.target_store)
+        target_layer = datastore.GetLayerByName(layer_name)
+        self.assertEqual(target_layer.GetFeatureCount(), DataSource(path)[0].num_feat)
+        result = datastore.ExecuteSQL("select NAME_CH from {0} where NAME_PY = 'An Zhou'".format(layer_name))
+        self.assertEqual(result.GetFeature(0).GetField('name_ch'), '安州')
+
+        # COPY only writes to the datastore, not to the database of another target store.
+        memory = osgeo.ogr.GetDriverByName('Memory').CreateDataSource('copy_writer')
+        with self.assertRaises(ValueError):
+            PostGISCopyWriter(memory.CreateLayer('copy_writer'), target_store="PG:dbname='other'")
+
+    def test_gpkg_feature_count(self):
+        """Regression test for GeoPackage FIDs starting at 1, every feature should be imported.
+        """
+        path = test_file('boxes_with_date.gpkg')
+        layer = self.generic_import(path, configs=[{'index': 0}])
+        ogr = OGRImport(path)
+        datastore, _ = ogr.open_target_datastore(ogr.target_store)
+        target_layer = datastore.GetLayerByName(layer.name)
+        self.assertEqual(target_layer.GetFeatureCount(), DataSource(path)[0].num_feat)
+
+    def test_parallel_import(self):
+        """Tests that a parallel multi-layer import keeps the configured layer order.
+        """
+        ogr = OGRImport(test_file('boxes_plus_raster.gpkg'))
+        ogr.workers = 2
+        configs = [{'index': i} for i in range(8)]
+        layers = ogr.import_file(configuration_options=configs)
+        self.assertEqual([config['index'] for _, config in layers], range(8))
+        self.assertTrue(all('modified_fields' in config for _, config in layers if not config['raster']))
+
+    def test_chunked_import(self):
+        """Tests loading a single layer in chunks with a pool of workers.
+        """
+        path = test_file('boxes_with_date.shp')
+        ogr = OGRImport(path)
+        ogr.workers = 2
+        ogr.chunk_size = 2
+        layer_name = ogr.import_file(configuration_options=[{'index': 0}])[0][0]
+        datastore, _ = ogr.open_target_datastore(ogr.target_store)
+        target_layer = datastore.GetLayerByName(layer_name)
+        self.assertEqual(target_layer.GetFeatureCount(), DataSource(path)[0].num_feat)
+
+    def test_map_workers_in_daemon(self):
+        """Tests that import workers are started from a daemonic process, like a celery prefork worker.
+        """
+        results = billiard.Queue()
+
+        def run():
+            ogr = OGRImport(test_file('boxes_with_date.shp'))
+            ogr.workers = 2
+            results.put(ogr.map_workers(abs, [-1, -2, -3]))
+
+        process = billiard.Process(target=run)
+        process.daemon = True
+        process.start()
+        self.assertEqual(results.get(timeout=60), [1, 2, 3])
+        process.join()
+
+    def test_map_workers_in_transaction(self):
+        """Tests that starting import workers keeps the database connections of a transaction open.
+        """
+        ogr = OGRImport(test_file('boxes_with_date.shp'))
+        ogr.workers = 2
+
+        with db.transaction.atomic(using='datastore'):
+            cursor = self.postgis.cursor()
+            cursor.execute('SELECT 1')
+            self.assertEqual(ogr.map_workers(abs, [-1, -2, -3]), [1, 2, 3])
+            cursor.execute('SELECT 1')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_deferred_indexes(self):
+        """Tests building the spatial and attribute indexes after the features are loaded.
+        """
+        layer = self.generic_import(
+            'boxes_with_date.shp',
+            configs=[
+                {
+                    'index': 0,
+                    'defer_indexes': True,
+                    'convert_to_date': ['date'],
+                    'start_date': 'date'
+                }
+            ]
+        )
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s', (layer.name,))
+        indexes = ' '.join(row[0] for row in cursor.fetchall())
+        self.assertIn('gist', indexes)
+        self.assertIn('date_as_date', indexes)
+
+    def test_staging_tables(self):
+        """Tests loading into an UNLOGGED staging table that is swapped into place after the date conversion.
+        """
+        layer = self.generic_import(
+            'boxes_with_date.shp',
+            configs=[
+                {
+                    'index': 0,
+                    'staging_tables': True,
+                    'convert_to_date': ['date']
+                }
+            ]
+        )
+        self.assertTrue(layer.name.startswith('boxes_with_date'))
+        self.assertTrue(get_layer_attr(layer, 'date_as_date'))
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT relpersistence FROM pg_class WHERE relname = %s', (layer.name,))
+        self.assertEqual(cursor.fetchone()[0], 'p')
+        cursor.execute("SELECT count(*) FROM pg_class WHERE relname LIKE 'import\\_%%' AND relkind = 'r'")
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_internal_layer_options(self):
+        """Tests that the tables renamed and dropped by the importer are never taken from the configuration options.
+        """
+        path = test_file('boxes_with_date.shp')
+        cursor = self.postgis.cursor()
+
+        try:
+            cursor.execute('CREATE TABLE internal_options (id integer)')
+
+            # A staging table without a target name would fail the import and drop the table.
+            for config in ({'staging_table': 'internal_options', 'target_name': 'renamed_internal_options'},
+                           {'staging_table': 'internal_options'}):
+                config['index'] = 0
+                results = self.import_file(path, configs=[config])
+                self.assertTrue(results[0][0].startswith('boxes_with_date'))
+                cursor.execute("SELECT relname FROM pg_class WHERE relname LIKE '%%internal_options'")
+                self.assertEqual(cursor.fetchall(), [('internal_options',)])
+        finally:
+            cursor.execute('DROP TABLE IF EXISTS internal_options')
+
+    def test_internal_stream_options(self):
+        """Tests that the stream converter and the converted fields are never taken from the configuration options.
+        """
+        layer = self.generic_import('boxes_with_date.shp', configs=[{
+            'index': 0,
+            'convert_to_date': ['date'],
+            'stream_columns': {'converter': 'osgeo_importer.tests.UploaderTests', 'columns': []},
+            'converted_fields': {'date': 'date'}
+        }])
+        self.assertTrue(get_layer_attr(layer, 'date_as_date'))
+
+    def test_append_layer(self):
+        """Tests appending the features of a file to a layer that was imported earlier.
+        """
+        layer = self.generic_import('boxes_with_date.shp', configs=[{'index': 0}])
+        path = test_file('boxes_with_date.shp')
+        results = self.import_file(path, configs=[{'index': 0, 'appendTo': 'geonode:{0}'.format(layer.name)}])
+        self.assertEqual(results[0][0], layer.name)
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*) FROM {0}'.format(layer.name))
+        self.assertEqual(cursor.fetchone()[0], DataSource(path)[0].num_feat * 2)
+        cursor.execute("SELECT count(*) FROM pg_class WHERE relname LIKE 'import\\_%%' AND relkind = 'r'")
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_append_upsert_key_without_unique_index(self):
+        """Tests that appending with an upsert key that has no unique index fails without changing the layer.
+        """
+        layer = self.generic_import('boxes_with_date.shp', configs=[{'index': 0}])
+        path = test_file('boxes_with_date.shp')
+
+        with self.assertRaises(AttributeError):
+            self.import_file(path, configs=[{'index': 0, 'appendTo': 'geonode:{0}'.format(layer.name),
+                                             'upsert_key': 'date'}])
+
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*) FROM {0}'.format(layer.name))
+        self.assertEqual(cursor.fetchone()[0], DataSource(path)[0].num_feat)
+        self.assertFalse(OGRImport.has_unique_index(layer.name, 'date'))
+
+    def test_reimport_unchanged_layer(self):
+        """Tests that re-importing an unchanged file does not modify the target layer.
+        """
+        layer = self.generic_import('boxes_with_date.shp', configs=[{'index': 0}])
+        path = test_file('boxes_with_date.shp')
+        results = self.import_file(path, configs=[{'index': 0, 'reimportTo': 'geonode:{0}'.format(layer.name)}])
+        self.assertEqual(results[0][0], layer.name)
+        self.assertEqual(results[0][1]['reimport'], {'inserted': 0, 'updated': 0, 'deleted': 0})
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*), count(import_hash) FROM {0}'.format(layer.name))
+        self.assertEqual(cursor.fetchone(), (DataSource(path)[0].num_feat, DataSource(path)[0].num_feat))
+
+    def test_configure_view_append_target(self):
+        """Tests that the configure api only appends to layers the user may change.
+        """
+        layer = self.generic_import('point_with_date.geojson', configs=[{'index': 0}])
+        client = AdminClient()
+        client.login_as_non_admin()
+
+        with open(test_file('point_with_date.geojson')) as stream:
+            client.post(reverse('uploads-new'), {'file': stream}, follow=True)
+
+        upload_layer = UploadLayer.objects.get(upload__user=self.non_admin_user)
+        url = '/importer-api/data-layers/{0}/configure/'.format(upload_layer.id)
+
+        response = client.post(url, data=json.dumps({'index': 0, 'appendTo': 'spatial_ref_sys'}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = client.post(url, data=json.dumps({'index': 0, 'appendTo': layer.typename}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        config = {'appendTo': layer.typename, 'styles': ['a.sld'], 'configureTime': True, 'start_date': 'date',
+                  'metadata': 'a.xml'}
+
+        for handler in (GeoWebCacheHandler, GeoServerBoundsHandler, GenericSLDHandler, GeoServerStyleHandler,
+                        GeoServerTimeHandler, GeoNodeMetadataHandler):
+            self.assertFalse(handler(None).can_run(layer.name, config))
+
+    def test_configure_view_reimport_target(self):
+        """Tests that the configure api only re-imports into layers the user may change, resolved on the server.
+        """
+        layer = self.generic_import('point_with_date.geojson', configs=[{'index': 0}])
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*) FROM {0}'.format(layer.name))
+        count = cursor.fetchone()[0]
+        client = AdminClient()
+        client.login_as_non_admin()
+
+        with open(test_file('point_with_date.geojson')) as stream:
+            client.post(reverse('uploads-new'), {'file': stream}, follow=True)
+
+        upload_layer = UploadLayer.objects.get(upload__user=self.non_admin_user)
+        upload_layer.layer = layer
+        upload_layer.save()
+        url = '/importer-api/data-layers/{0}/configure/'.format(upload_layer.id)
+
+        response = client.post(url, data=json.dumps({'index': 0, 'reimport_from': upload_layer.id}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        response = client.post(url, data=json.dumps({'index': 0, 'reimportTo': 'geonode:{0}'.format(layer.name)}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('reimportTo', UploadLayer.objects.get(id=upload_layer.id).configuration_options)
+        cursor.execute('SELECT count(*) FROM {0}'.format(layer.name))
+        self.assertEqual(cursor.fetchone()[0], count)
+
+    def test_postgis_field_converter(self):
+        """Tests that converting dates in SQL gives the same results as parsing every value with dateutil.
+        """
+        layer = self.generic_import('boxes_with_date.shp', configs=[{'index': 0}])
+        target_store = OGRImport(test_file('boxes_with_date.shp')).target_store
+
+        with OGRFieldConverter(target_store) as converter:
+            expected = converter.convert_field(layer.name, 'date')
+
+        with PostGISFieldConverter(target_store) as converter:
+            converted = converter.convert_field(layer.name, 'date')
+
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*) FROM {0} WHERE {1} IS DISTINCT FROM {2}'.format(layer.name, expected,
+                                                                                      converted))
+        self.assertEqual(cursor.fetchone()[0], 0)
+
+    def test_field_converter_handler_partial_failure(self):
+        """Tests that a date field that fails to convert doesn't keep the other fields from being converted.
+        """
+        layer = self.generic_import('boxes_with_end_date.shp', configs=[{'index': 0}])
+
+        class FailingFieldConverterHandler(FieldConverterHandler):
+            def convert_fields_to_time(self, layer, fields):
+                # Fails once the columns of the other fields were added.
+                converted = super(FailingFieldConverterHandler, self).convert_fields_to_time(
+                    layer, [field for field in fields if field != 'enddate'])
+                if 'enddate' in fields:
+                    raise RuntimeError('Unable to convert enddate.')
+                return converted
+
+        layer_config = {'convert_to_date': ['date', 'enddate', 'missing'], 'start_date': 'date',
+                        'end_date': 'enddate'}
+        FailingFieldConverterHandler(None).handle(layer.name, layer_config)
+
+        self.assertEqual(layer_config['start_date'], 'date_as_date')
+        self.assertEqual(layer_config['end_date'], 'enddate')
+
+        cursor = self.postgis.cursor()
+        cursor.execute('SELECT count(*), count(date_as_date) FROM {0}'.format(layer.name))
+        count, converted = cursor.fetchone()
+        self.assertEqual(count, converted)
+
+        # The columns added by the failed conversion were dropped before the fields were converted one by one.
+        cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s AND "
+                       "column_name LIKE 'date\\_as\\_date%%'", (layer.name,))
+        self.assertEqual(cursor.fetchall(), [('date_as_date',)])
+
+        # Without the failing field, the remaining fields are converted together, the missing one is skipped.
+        layer_config = {'convert_to_date': ['enddate', 'missing'], 'end_date': 'enddate'}
+        FieldConverterHandler(None).handle(layer.name, layer_config)
+        self.assertEqual(layer_config['end_date'], 'enddate_as_date')
+
+    def test_timeparse_many(self):
+        """Tests that parsing a column of dates gives the same results as parsing the values one by one.
+        """
+        values = ['2001-02-03', '1990', '2001-02-03', '44 BC', 'March 5, 1998', 'not a date', '2001-02-03']
+        xds, parsed = timeparse_many(values)
+        self.assertEqual(zip(xds.tolist(), list(parsed)), [timeparse(value) for value in values])
+
+        xds, parsed = timeparse_many(['2001-02-03', '1990-01-01T12:00'])
+        self.assertEqual(list(parsed), ['2001-02-03T00:00:00.000', '1990-01-01T12:00:00.000'])
+
+    def test_stream_date_conversion(self):
+        """Tests that dates converted while features are loaded match the dates converted by the handler.
+        """
+        results = {}
+
+        for stream_conversion in (True, False):
+            layer = self.generic_import('boxes_with_date.shp', configs=[{
+                'index': 0,
+                'convert_to_date': ['date'],
+                'stream_conversion': stream_conversion
+            }])
+            cursor = self.postgis.cursor()
+            cursor.execute('SELECT date_as_date FROM {0} ORDER BY ogc_fid'.format(layer.name))
+            results[stream_conversion] = cursor.fetchall()
+
+        self.assertTrue(any(row[0] for row in results[True]))
+        self.assertEqual(results[True], results[False])
+
+    def test_infer_date_format(self):
+        """Tests inferring a single date format from a sample of values.
+        """
+        self.assertEqual(infer_date_format(['12/25/2001', '01/02/2003', '']).format, '%m/%d/%Y')
+        self.assertEqual(infer_date_format(['25/12/2001', '01/02/2003']).format, '%d/%m/%Y')
+        self.assertEqual(infer_date_format(['2001-02-03', '1999-12-31']).sql, (r'^\d{4}\-\d{1,2}\-\d{1,2}$',
+                                                                              'YYYY-MM-DD'))
+        self.assertIsNone(infer_date_format(['2001-02-03', 'tomorrow']))
+
+        date_format = infer_date_format(['15 Mar 0044 BC', '01 Jan 0014 AD'])
+        self.assertEqual(date_format.era, 'suffix')
+        self.assertIsNone(date_format.parse('15 Mar 0044 BC'))
+        self.assertEqual(date_format.timeparse('15 Mar 0044 BC'), timeparse('-0044-03-15'))
+
+    def test_describe_fields_cache(self):
+        """Tests that a file inspected again once moved is described from the cache, unless it changed.
+        """
+        path = test_file('US_Shootings.csv')
+        copy_dir = tempfile.mkdtemp()
+
+        try:
+            copied = os.path.join(copy_dir, os.path.basename(path))
+            moved = os.path.join(copy_dir, 'moved', os.path.basename(path))
+            shutil.copy(path, copied)
+
+            with GDALInspector(copied) as inspector:
+                layers = inspector.describe_fields()
+                file_type = inspector.file_type()
+
+            os.renames(copied, moved)
+
+            with GDALInspector(moved) as inspector:
+                self.assertEqual(inspector.describe_fields(), layers)
+                self.assertEqual(inspector.file_type(), file_type)
+                # The moved file was never opened.
+                self.assertIsNone(inspector.data)
+
+            # A link to the same file under another name has other layer names.
+            linked = os.path.join(copy_dir, 'linked.csv')
+            os.link(moved, linked)
+
+            with GDALInspector(linked) as inspector:
+                self.assertEqual(inspector.describe_fields()[0]['layer_name'], 'linked')
+                self.assertIsNotNone(inspector.data)
+
+            # Files written in place with the same size are described again.
+            stat = os.stat(moved)
+            os.utime(moved, (stat.st_atime, stat.st_mtime + 1))
+
+            with GDALInspector(moved) as inspector:
+                self.assertEqual(inspector.describe_fields(), layers)
+                self.assertIsNotNone(inspector.data)
+        finally:
+            shutil.rmtree(copy_dir)
+
+    def test_describe_subdatasets(self):
+        """Tests that the subdatasets of a raster are described without being opened, then imported by index.
+        """
+        outdir = tempfile.mkdtemp()
+        path = os.path.join(outdir, 'subdatasets.gpkg')
+
+        try:
+            source = gdal.GetDriverByName('MEM').Create('', 16, 16, 1, gdal.GDT_Byte)
+            source.SetGeoTransform([-10, 1, 0, 10, 0, -1])
+            srs = osgeo.osr.SpatialReference()
+            srs.ImportFromEPSG(4326)
+            source.SetProjection(srs.ExportToWkt())
+
+            for options in (['RASTER_TABLE=first'], ['RASTER_TABLE=second', 'APPEND_SUBDATASET=YES']):
+                # Close each copy before appending the next one.
+                copied = gdal.GetDriverByName('GPKG').CreateCopy(path, source, options=options)
+                copied = None
+
+            with GDALInspector(path) as inspector:
+                subdatasets = [layer for layer in inspector.describe_fields() if 'subdataset_index' in layer]
+                self.assertEqual([layer['layer_name'] for layer in subdatasets], ['first', 'second'])
+                # Describing the file doesn't open its subdatasets.
+                self.assertFalse(any('size' in layer for layer in subdatasets))
+
+                inspector.describe_subdatasets(subdatasets, 2)
+                self.assertEqual([(layer['size'], layer['bands']) for layer in subdatasets], [([16, 16], 1)] * 2)
+
+            results = self.import_file(path, configs=[{'index': subdatasets[1]['index']}])
+            self.assertEqual(len(results), 1)
+            self.assertEqual(results[0][1]['path'], subdatasets[1]['path'])
+            self.assertEqual(gdal.OpenEx(results[0][0]).RasterCount, 1)
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_describe_fields_fast_count(self):
+        """Tests that describe_fields only counts features when the driver can count them quickly.
+        """
+        with GDALInspector(test_file('US_Shootings.csv')) as inspector:
+            layers = inspector.describe_fields(exact_count=False)
+            self.assertIsNone(layers[0]['feature_count'])
+            self.assertEqual(inspector.feature_count(layers[0]['index']), 203)
+
+        with GDALInspector(test_file('boxes_with_year_field.shp')) as inspector:
+            layers = inspector.describe_fields(exact_count=False)
+            self.assertEqual(layers[0]['feature_count'], inspector.feature_count(0))
+
+    def test_describe_geometries(self):
+        """Tests the extent, EPSG code and geometry types added to layer descriptions.
+        """
+        with GDALInspector(test_file('boxes_with_year_field.shp')) as inspector:
+            layer = inspector.describe_fields(describe_geometries=True)[0]
+
+        self.assertEqual(len(layer['extent']), 4)
+        self.assertEqual(sum(layer['geometry_types'].values()), layer['feature_count'])
+        self.assertEqual(layer['multipart'], any(name.startswith('Multi') for name in layer['geometry_types']))
+
+        with GDALInspector(test_file('US_Shootings.csv')) as inspector:
+            layer = inspector.describe_fields(describe_geometries=True)[0]
+
+        self.assertEqual(layer['geometry_types'].keys(), ['Point'])
+        self.assertFalse(layer['multipart'])
+
+    def test_dataset_pool(self):
+        """Tests that inspectors share their datasets inside a DatasetPool.
+        """
+        path = test_file('point_with_date.geojson')
+
+        with DatasetPool():
+            with GDALInspector(path) as first, GDALInspector(path) as second:
+                self.assertIs(first.open(), second.open())
+
+        self.assertIsNot(GDALInspector(path).open(), GDALInspector(path).open())
+
+    def test_zip_member(self):
+        """Tests validating a file of a zip through /vsizip/ and extracting only that file.
+        """
+        path = test_file('boxes_with_date.zip')
+
+        with ZipFile(path) as archive:
+            shp = [name for name in archive.namelist() if name.endswith('.shp')][0]
+
+        member = ZipMember(path, shp)
+        self.assertTrue(validators.validate_inspector_can_read(member.name))
+
+        outdir = tempfile.mkdtemp()
+
+        try:
+            extracted = member.extract(outdir)
+            self.assertEqual(os.listdir(outdir), [os.path.basename(shp)])
+            self.assertEqual(extracted, os.path.join(outdir, os.path.basename(shp)))
+        finally:
+            shutil.rmtree(outdir)
+
+    def test_chunked_upload(self):
+        """Tests uploading a file in chunks through the file-upload API.
+        """
+        client = AdminClient()
+        client.login_as_non_admin()
+
+        with open(test_file('point_with_date.geojson')) as stream:
+            data = stream.read()
+
+        response = client.post('/importer-api/file-upload/chunked/',
+                               data=json.dumps({'name': 'point_with_date.geojson', 'size': len(data)}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        url = '/importer-api/file-upload/chunked/{0}/'.format(json.loads(response.content)['id'])
+
+        middle = len(data) // 2
+        response = client.put(url + '?offset=0', data=data[:middle], content_type='application/octet-stream')
+        self.assertEqual(json.loads(response.content)['offset'], middle)
+
+        # An upload missing bytes can't be completed.
+        response = client.post(url + 'complete/')
+        self.assertEqual(response.status_code, 400)
+
+        # A chunk sent at the wrong offset is refused with the offset to resume from.
+        response = client.put(url + '?offset=0', data=data[middle:], content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(json.loads(response.content)['offset'], middle)
+
+        client.put(url + '?offset={0}'.format(middle), data=data[middle:], content_type='application/octet-stream')
+        status = json.loads(client.get(url).content)
+        self.assertEqual(status['checksum'], '%08x' % (zlib.crc32(data) & 0xffffffff))
+
+        response = client.post(url + 'complete/', data=json.dumps({'checksum': status['checksum']}),
+                               content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['state'], 'UPLOADED')
+        self.assertEqual(UploadLayer.objects.filter(upload=status['id']).count(), 1)
+
+    def test_inspect_upload(self):
+        """Tests creating the upload layers of saved upload files in the inspect_upload task.
+        """
+        upload = UploadedData.objects.create(state='UPLOADED', complete=True, name='point_with_date.geojson')
+        upload_dir = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(upload_dir, 'point_with_date.geojson')
+            shutil.copy(test_file('point_with_date.geojson'), path)
+            upfile = UploadFile.objects.create(upload=upload)
+            upfile.file.name = path
+            upfile.save()
+
+            inspect_upload(upload.id)
+
+            self.assertEqual(UploadedData.objects.get(id=upload.id).state, 'INSPECTED')
+            self.assertEqual(UploadedData.objects.get(id=upload.id).file_type, 'GeoJSON')
+            self.assertEqual(UploadFile.objects.get(id=upfile.id).file_type, 'GeoJSON')
+            self.assertEqual(UploadLayer.objects.filter(upload=upload).count(), 1)
+        finally:
+            shutil.rmtree(upload_dir)
+
+    def test_stored_geometry_description(self):
+        """Tests that the importer uses the geometry description stored on the upload layers.
+        """
+        upload = UploadedData.objects.create(state='UPLOADED', complete=True)
+        upload_dir = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(upload_dir, 'point_with_date.geojson')
+            shutil.copy(test_file('point_with_date.geojson'), path)
+            upfile = UploadFile.objects.create(upload=upload)
+            upfile.file.name = path
+            upfile.save()
+
+            inspect_upload(upload.id)
+
+            with GDALInspector(path) as inspector:
+                layer = inspector.describe_fields(describe_geometries=True)[0]
+
+            upload_layer = UploadLayer.objects.get(upload=upload)
+            self.assertEqual(upload_layer.multipart, layer['multipart'])
+
+            stored = OGRImport(path, upload_file=upfile).stored_descriptions()
+            self.assertEqual(stored, {0: {'extent': upload_layer.extent, 'srid': upload_layer.srid,
+                                          'geometry_types': upload_layer.geometry_types,
+                                          'multipart': upload_layer.multipart}})
+        finally:
+            shutil.rmtree(upload_dir)
+
+    def test_validate_files(self):
+        """Tests validating several files at once, in the order they were given.
+        """
+        paths = [test_file('point_with_date.geojson'), test_file('boxes.sld'), test_file('US_Shootings.csv'),
+                 test_file('does_not_exist.geojson')]
+        self.assertEqual(validate_files(paths, threads=3), [True, True, True, False])
+        # Uploads inspected by the inspect_upload task are only checked to open.
+        self.assertEqual([validators.validate_inspector_can_open(path) for path in paths], [True, True, True, False])
+
+    def test_blob_store(self):
+        """Tests that identical files share a blob which is removed once no file links to it.
+        """
+        if not os.path.exists(MEDIA_ROOT):
+            os.makedirs(MEDIA_ROOT)
+
+        upload_dirs = [tempfile.mkdtemp(dir=MEDIA_ROOT), tempfile.mkdtemp(dir=MEDIA_ROOT)]
+
+        try:
+            paths = [os.path.join(upload_dir, 'point_with_date.geojson') for upload_dir in upload_dirs]
+            for path in paths:
+                shutil.copy(test_file('point_with_date.geojson'), path)
+
+            digest = blobs.store(paths[0])
+            self.assertEqual(blobs.store(paths[1]), digest)
+            self.assertTrue(os.path.samefile(paths[0], paths[1]))
+
+            remove_path(upload_dirs[0], [digest])
+            self.assertTrue(os.path.exists(blobs.blob_path(digest)))
+            remove_path(upload_dirs[1], [digest])
+            self.assertFalse(os.path.exists(blobs.blob_path(digest)))
+        finally:
+            for upload_dir in upload_dirs:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def test_delete_upload_releases_blobs(self):
+        """Tests that deleting an upload removes its directory and the blobs no other upload uses.
+        """
+        if not os.path.exists(MEDIA_ROOT):
+            os.makedirs(MEDIA_ROOT)
+
+        upload_dirs = [tempfile.mkdtemp(dir=MEDIA_ROOT), tempfile.mkdtemp(dir=MEDIA_ROOT)]
+
+        try:
+            uploads = []
+
+            for upload_dir in upload_dirs:
+                path = os.path.join(upload_dir, 'point_with_date.geojson')
+                shutil.copy(test_file('point_with_date.geojson'), path)
+                upload = UploadedData.objects.create(state='UPLOADED', complete=True)
+                upfile = UploadFile.objects.create(upload=upload, content_hash=blobs.store(path))
+                upfile.file.name = path
+                upfile.save()
+                uploads.append(upload)
+
+            digest = upfile.content_hash
+            uploads[0].delete()
+            self.assertFalse(os.path.exists(upload_dirs[0]))
+            self.assertTrue(os.path.exists(blobs.blob_path(digest)))
+            uploads[1].delete()
+            self.assertFalse(os.path.exists(upload_dirs[1]))
+            self.assertFalse(os.path.exists(blobs.blob_path(digest)))
+        finally:
+            for upload_dir in upload_dirs:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+
 if __name__ == '__main__':
     unittest.main()
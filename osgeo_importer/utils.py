@@ -5,7 +5,9 @@ import osr
 import os
 import re
 import sys
+import threading
 
+from collections import OrderedDict
 from cStringIO import StringIO
 from datetime import datetime
 from dateutil.parser import parse
@@ -43,23 +45,37 @@ GDAL_GEOMETRY_TYPES = {
    }
 
 
-def timeparse(timestr):
-    import numpy
-    DEFAULT = datetime(1, 1, 1)
+BC_PATTERN = re.compile(r'bce?', flags=re.I)
+NEGATIVE_PATTERN = re.compile('-', flags=re.I)
+AD_PATTERN = re.compile('ad', flags=re.I)
+DEFAULT_DATETIME = datetime(1, 1, 1)
+
+
+def normalize_timestr(timestr):
+    """
+    Replaces BC/BCE and AD markers of a date string with a sign.
+
+    :return: A tuple of the normalized string and whether it is a BC date.
+    """
     bc = False
-    if re.search(r'bce?', timestr, flags=re.I):
+    if BC_PATTERN.search(timestr):
         bc = True
-        timestr = re.sub(r'bce?', '', timestr, flags=re.I)
-    if re.match('-', timestr, flags=re.I):
+        timestr = BC_PATTERN.sub('', timestr)
+    if NEGATIVE_PATTERN.match(timestr):
         bc = True
         timestr = timestr.replace('-', '', 1)
-    if re.search(r'ad', timestr, flags=re.I):
-        timestr = re.sub('ad', '', timestr, flags=re.I)
+    if AD_PATTERN.search(timestr):
+        timestr = AD_PATTERN.sub('', timestr)
 
     if bc is True:
         timestr = "-%s" % timestr
 
-    timestr = timestr.strip()
+    return timestr.strip(), bc
+
+
+def timeparse(timestr):
+    import numpy
+    timestr, bc = normalize_timestr(timestr)
 
     try:
         t = numpy.datetime64(timestr).astype('datetime64[ms]').astype('int64')
@@ -72,7 +88,7 @@ def timeparse(timestr):
     if bc is False:
         try:
             logger.debug('trying %s as direct parse', timestr)
-            dt = parse(timestr, default=DEFAULT)
+            dt = parse(timestr, default=DEFAULT_DATETIME)
             t = numpy.datetime64(dt.isoformat()).astype('datetime64[ms]').astype('int64')
             return t, str(numpy.datetime64(t, 'ms'))
         except:
@@ -81,6 +97,288 @@ def timeparse(timestr):
     return None, None
 
 
+def timeparse_many(timestrs, date_format=None):
+    """
+    Parses a column of date strings like `timeparse`.
+
+    Distinct values are parsed once, with a single vectorized numpy.datetime64 conversion when all of them are
+    ISO 8601 strings, falling back to `date_format` (see `infer_date_format`) and `timeparse` value by value
+    otherwise.
+
+    :return: A tuple of a masked int64 array of milliseconds since the epoch and an array of ISO 8601 strings (None
+    where a value could not be parsed), both in the order of `timestrs`.
+    """
+    import numpy
+    unique, inverse = numpy.unique(numpy.array(timestrs, dtype=object), return_inverse=True)
+    normalized = [normalize_timestr(timestr)[0] for timestr in unique]
+    mask = numpy.zeros(len(unique), dtype=bool)
+
+    try:
+        xd = numpy.array(normalized, dtype='datetime64[ms]').astype('int64')
+    except (ValueError, TypeError):
+        xd = numpy.zeros(len(unique), dtype='int64')
+
+        for i, timestr in enumerate(unique):
+            t = date_format.timeparse(timestr)[0] if date_format else None
+
+            if t is None:
+                t, _ = timeparse(timestr)
+
+            if t is None:
+                mask[i] = True
+            else:
+                xd[i] = t
+
+    parsed = numpy.array(numpy.datetime_as_string(xd.astype('datetime64[ms]')), dtype=object)
+    parsed[mask] = None
+
+    return numpy.ma.masked_array(xd, mask=mask)[inverse], parsed[inverse]
+
+
+# Formats tried by infer_date_format, in order. Month first formats come before day first ones, like dateutil.
+DATE_FORMATS = getattr(settings, 'OSGEO_IMPORTER_DATE_FORMATS', [
+    '%Y-%m-%d',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S.%f',
+    '%Y-%m-%d %H:%M:%S.%f',
+    '%Y/%m/%d',
+    '%Y/%m/%d %H:%M:%S',
+    '%m/%d/%Y',
+    '%m/%d/%Y %H:%M:%S',
+    '%m/%d/%Y %H:%M',
+    '%d/%m/%Y',
+    '%d/%m/%Y %H:%M:%S',
+    '%d/%m/%Y %H:%M',
+    '%m-%d-%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%Y%m%d',
+    '%b %d, %Y',
+    '%B %d, %Y',
+    '%d %b %Y',
+    '%d %B %Y',
+])
+
+# Number of values sampled per field by infer_date_format.
+DATE_SAMPLE_SIZE = getattr(settings, 'OSGEO_IMPORTER_DATE_SAMPLE_SIZE', 100)
+
+ERA_PATTERN = re.compile(r'\s*\b(bce?|ad|ce)\b\.?\s*', flags=re.I)
+
+# strptime directives and their (regular expression, PostgreSQL to_timestamp pattern).
+STRPTIME_DIRECTIVES = {
+    'Y': (r'\d{4}', 'YYYY'),
+    'm': (r'\d{1,2}', 'MM'),
+    'd': (r'\d{1,2}', 'DD'),
+    'H': (r'\d{1,2}', 'HH24'),
+    'M': (r'\d{1,2}', 'MI'),
+    'S': (r'\d{1,2}', 'SS'),
+}
+
+
+class DateFormat(object):
+    """
+    A date format shared by the values of a field, see `infer_date_format`.
+
+    :param format: A strptime format.
+    :param era: How BC dates are marked, 'suffix' (i.e. 44 BC, 14 AD) or 'sign' (a leading '-'), None if they
+    are not.
+    """
+
+    def __init__(self, format, era=None):
+        self.format = format
+        self.era = era
+
+    @classmethod
+    def from_description(cls, description):
+        """
+        Returns a DateFormat from the `date_format` of a field description, or None.
+        """
+        if description:
+            return cls(description['format'], description.get('era'))
+
+    def describe(self):
+        return {'format': self.format, 'era': self.era}
+
+    def split_era(self, value):
+        """
+        Removes the era marker of a value.
+
+        :return: A tuple of the value and whether it is a BC date.
+        """
+        value = value.strip()
+
+        if self.era == 'suffix':
+            match = ERA_PATTERN.search(value)
+
+            if match:
+                return ERA_PATTERN.sub(' ', value).strip(), match.group(1).lower().startswith('b')
+
+        elif self.era == 'sign' and value.startswith('-'):
+            return value[1:], True
+
+        return value, False
+
+    def strptime(self, value):
+        """
+        :return: A tuple of the parsed datetime (None if the value does not match the format) and whether it is a
+        BC date.
+        """
+        value, bc = self.split_era(value)
+
+        try:
+            return datetime.strptime(value, self.format), bc
+        except ValueError:
+            return None, bc
+
+    def parse(self, value):
+        """
+        Returns the datetime of a value, or None when it does not match the format or is a BC date.
+        """
+        parsed, bc = self.strptime(value)
+        return None if bc else parsed
+
+    def timeparse(self, value):
+        """
+        Parses a value like `timeparse`, returning (None, None) when it does not match the format.
+        """
+        import numpy
+        parsed, bc = self.strptime(value)
+
+        if parsed is None:
+            return None, None
+
+        iso = '{0}{1:04d}-{2:02d}-{3:02d}T{4:02d}:{5:02d}:{6:02d}.{7:03d}'.format(
+            '-' if bc else '', parsed.year, parsed.month, parsed.day, parsed.hour, parsed.minute, parsed.second,
+            parsed.microsecond // 1000)
+        t = numpy.datetime64(iso).astype('datetime64[ms]').astype('int64')
+        return t, str(numpy.datetime64(t, 'ms'))
+
+    @property
+    def sql(self):
+        """
+        Returns a (regular expression, to_timestamp pattern) tuple to convert values in PostgreSQL, or None when the
+        format can not be translated.
+        """
+        if self.era:
+            return
+
+        regex, pattern = ['^'], []
+        tokens = re.split('(%.)', self.format)
+
+        for token in tokens:
+            if token.startswith('%'):
+                if token[1:] not in STRPTIME_DIRECTIVES:
+                    return
+
+                regex.append(STRPTIME_DIRECTIVES[token[1:]][0])
+                pattern.append(STRPTIME_DIRECTIVES[token[1:]][1])
+            elif token:
+                regex.append(re.escape(token))
+                pattern.append(token if token.isspace() or not token.isalpha() else '"{0}"'.format(token))
+
+        regex.append('$')
+        return ''.join(regex), ''.join(pattern)
+
+
+def infer_date_format(values, sample_size=None):
+    """
+    Samples up to `sample_size` non-empty values and returns the first of DATE_FORMATS all of them match, as a
+    DateFormat, or None.
+    """
+    sample = []
+
+    for value in values:
+        if value and isinstance(value, basestring) and value.strip():
+            sample.append(value.strip())
+
+            if len(sample) >= (sample_size or DATE_SAMPLE_SIZE):
+                break
+
+    if not sample:
+        return
+
+    era = None
+
+    if any(ERA_PATTERN.search(value) for value in sample):
+        era = 'suffix'
+    elif any(value.startswith('-') for value in sample):
+        era = 'sign'
+
+    for date_format in DATE_FORMATS:
+        candidate = DateFormat(date_format, era)
+
+        if all(candidate.strptime(value)[0] is not None for value in sample):
+            return candidate
+
+
+SHAPEFILE_PARTS = ['shx', 'dbf', 'prj', 'cpg']
+
+
+def file_fingerprint(path):
+    """
+    Returns a key identifying the version of a file (and of the other parts of a shapefile), or None when the path
+    is not a local file.
+
+    Files are identified by their name, device, inode, size and modification time, which are kept when a file is
+    moved within a file system (i.e. into the upload directory) and change whenever the file is written. The name is
+    part of the key since layer names are derived from it, and identical uploads share an inode (see blobs).
+    """
+    if not os.path.isfile(path):
+        return
+
+    paths = [path]
+    base, extension = os.path.splitext(path)
+
+    if extension.lower() == '.shp':
+        for part in SHAPEFILE_PARTS:
+            paths.extend(candidate for candidate in (base + '.' + part, base + '.' + part.upper())
+                         if os.path.isfile(candidate))
+
+    fingerprint = []
+
+    for part in paths:
+        stat = os.stat(part)
+        fingerprint.append((os.path.basename(part), stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime))
+
+    return tuple(fingerprint)
+
+
+class LRUCache(object):
+    """
+    A thread safe mapping that keeps the `size` most recently used items.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.items:
+                return default
+
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def set(self, key, value):
+        if self.size <= 0:
+            return
+
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
 def ensure_defaults(layer):
     """
     Sets a geoserver feature type defaults.
@@ -248,6 +546,15 @@ def raster_import(infile, outfile, *args, **kwargs):
     return outfile
 
 
+def datastore_connection_string():
+    """
+    Returns the OGR connection string of the OSGEO_DATASTORE database.
+    """
+    d = db.connections[settings.OSGEO_DATASTORE].settings_dict
+    return "PG:dbname='%s' user='%s' password='%s' host='%s' port='%s'" % (d['NAME'], d['USER'], d['PASSWORD'],
+                                                                           d['HOST'], d['PORT'])
+
+
 def quote_ident(str):
     conn = db.connections[settings.OSGEO_DATASTORE]
     cursor = conn.cursor()
@@ -1,6 +1,6 @@
 import os
 from .utils import NoDataSourceFound, load_handler
-from .importers import OSGEO_IMPORTER, VALID_EXTENSIONS
+from .importers import ASYNC_INSPECTION, OSGEO_IMPORTER, VALID_EXTENSIONS
 import logging
 
 logger = logging.getLogger(__name__)
@@ -50,9 +50,35 @@ def validate_inspector_can_read(filename):
         importer = load_handler(OSGEO_IMPORTER, filename)
         data, inspector = importer.open_source_datastore(filename)
         # Ensure the data has a geometry.
-        for description in inspector.describe_fields():
+        for description in inspector.describe_fields(exact_count=False):
             if description.get('raster') is False and description.get('geom_type') in inspector.INVALID_GEOMETRY_TYPES:
                 return False
     except NoDataSourceFound:
         return False
     return True
+
+
+def validate_inspector_can_open(filename):
+    """
+    Only checks that a driver opens the file, it is described by the inspect_upload task.
+    """
+    filedir, file = os.path.split(filename)
+    base, extension = os.path.splitext(file)
+    extension = extension.lstrip('.').lower()
+    if extension in NONDATA_EXTENSIONS:
+        return True
+    try:
+        importer = load_handler(OSGEO_IMPORTER, filename)
+        importer.open_source_datastore(filename)
+    except NoDataSourceFound:
+        return False
+    return True
+
+
+def validate_upload(filename):
+    """
+    Validates an uploaded file, with ASYNC_INSPECTION only checking that it opens.
+    """
+    if ASYNC_INSPECTION:
+        return validate_inspector_can_open(filename)
+    return validate_inspector_can_read(filename)
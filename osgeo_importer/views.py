@@ -9,8 +9,9 @@ from django.core.urlresolvers import reverse_lazy
 from django.utils.text import Truncator
 from .forms import UploadFileForm
 from .models import UploadedData, UploadLayer, UploadFile, DEFAULT_LAYER_CONFIGURATION
-from .importers import OSGEO_IMPORTER, VALID_EXTENSIONS
-from .inspectors import OSGEO_INSPECTOR
+from . import blobs
+from .importers import ASYNC_INSPECTION, DEDUPLICATE_UPLOADS, OSGEO_IMPORTER, VALID_EXTENSIONS
+from .inspectors import OSGEO_INSPECTOR, DatasetPool
 from .utils import import_string, NoDataSourceFound
 from django.core.files.storage import FileSystemStorage
 
@@ -63,17 +64,144 @@ class ImportHelper(object):
 
     inspector = OSGEO_INSPECTOR
 
-    def get_fields(self, path):
+    def get_fields(self, path, exact_count=True):
         """
         Returns a list of field names and types.
         """
         with self.inspector(path) as opened_file:
-            return opened_file.describe_fields()
+            return opened_file.describe_fields(exact_count=exact_count)
 
     def get_file_type(self, path):
         with self.inspector(path) as opened_file:
             return opened_file.file_type()
 
+    @staticmethod
+    def get_upload_dir(upload):
+        """
+        Returns the directory of the files of an upload, based on the upload pk.
+        """
+        outpath = os.path.join('osgeo_importer_uploads', str(upload.pk))
+        outdir = os.path.join(FileSystemStorage().location, outpath)
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        return outdir
+
+    def create_upload_files(self, upload, finalfiles, inspect=True):
+        """
+        Creates the upload files of the files moved into the upload directory, and their upload layers unless
+        `inspect` is False (see `inspect_upload_files`).
+        """
+        # bulk_create doesn't call UploadFile.save, which sets the slug.
+        UploadFile.objects.bulk_create([UploadFile(upload=upload, file=each, slug=each) for each in finalfiles])
+        upfiles = list(upload.uploadfile_set.order_by('id'))
+        upload.size = sum(
+            upfile.file.size for upfile in upfiles
+        )
+        upload.complete = True
+        upload.state = UploadedData.STATE_UPLOADED
+        upload.save()
+
+        if inspect:
+            self.inspect_upload_files(upload, upfiles)
+
+    @staticmethod
+    def get_inspected_file(upfile):
+        """
+        Returns an earlier upload file with the same name and content as `upfile` whose layers can be reused, or None.
+
+        Shapefiles are always inspected since their layers also depend on the other files of the shapefile.
+        """
+        basename = os.path.basename(upfile.file.name)
+
+        if not upfile.content_hash or basename.lower().endswith('.shp'):
+            return
+
+        previous = UploadFile.objects.filter(content_hash=upfile.content_hash, file__endswith=os.sep + basename,
+                                             uploadlayer__isnull=False).exclude(id=upfile.id)
+        return previous.order_by('-id').first()
+
+    def inspect_upload_files(self, upload, upfiles):
+        """
+        Stores the content hash of upload files (see DEDUPLICATE_UPLOADS), detects their file type and creates the upload
+        layers of their layers.
+        """
+        # Loop through and create uploadlayers
+        file_types = collections.defaultdict(list)
+        upload_layers = []
+        uncounted = set()
+        # File type detection and description of each file share the dataset they open.
+        with DatasetPool():
+            for upfile in upfiles:
+                each = upfile.file.name
+                upfile_basename = os.path.basename(each)
+                _, upfile_ext = os.path.splitext(upfile_basename)
+
+                # Identical files share their blob on disk and their inspection, see get_inspected_file.
+                if DEDUPLICATE_UPLOADS and not upfile.content_hash:
+                    upfile.content_hash = blobs.store(each)
+                    UploadFile.objects.filter(id=upfile.id).update(content_hash=upfile.content_hash)
+
+                previous = self.get_inspected_file(upfile)
+                description = []
+                if previous is not None:
+                    # The same file was uploaded and inspected before, reuse its file type and layers.
+                    upfile.file_type = previous.file_type
+                    description = [dict(layer_name=layer.layer_name, fields=layer.fields, index=layer.index,
+                                        feature_count=layer.feature_count, extent=layer.extent, srid=layer.srid,
+                                        geometry_types=layer.geometry_types, multipart=layer.multipart,
+                                        raster=layer.raster)
+                                   for layer in previous.uploadlayer_set.order_by('index')]
+                else:
+                    # Detect and store file type for later reporting, since it is no
+                    # longer true that every upload has only one file type.
+                    try:
+                        upfile.file_type = self.get_file_type(each)
+                    except NoDataSourceFound:
+                        upfile.file_type = None
+                    if upfile_ext.lower() not in ['.prj', '.dbf', '.shx']:
+                        # Features that can't be counted quickly are counted by the count_features task.
+                        description = self.get_fields(each, exact_count=False)
+                file_types[upfile.file_type].append(upfile.id)
+                for layer in description:
+                    configuration_options = DEFAULT_LAYER_CONFIGURATION.copy()
+                    configuration_options.update({'index': layer.get('index')})
+                    layer_basename = os.path.basename(
+                        layer.get('layer_name') or ''
+                    )
+                    upload_layers.append(UploadLayer(
+                        upload=upload,
+                        upload_file=upfile,
+                        name=upfile_basename,
+                        layer_name=layer_basename,
+                        fields=layer.get('fields', {}),
+                        index=layer.get('index'),
+                        feature_count=layer.get('feature_count', None),
+                        extent=layer.get('extent'),
+                        srid=layer.get('srid'),
+                        geometry_types=layer.get('geometry_types'),
+                        multipart=layer.get('multipart'),
+                        raster=bool(layer.get('raster')),
+                        configuration_options=configuration_options
+                    ))
+
+                    if layer.get('feature_count') is None and not layer.get('raster'):
+                        uncounted.add((upfile.id, layer.get('index')))
+
+        for file_type, upfile_ids in file_types.items():
+            UploadFile.objects.filter(id__in=upfile_ids).update(file_type=file_type)
+
+        UploadLayer.objects.bulk_create(upload_layers)
+
+        if not uncounted:
+            return
+
+        # bulk_create doesn't set the ids of the new layers, look them up for the count_features task.
+        from .tasks import count_features
+        upload_layers = UploadLayer.objects.filter(upload_file__in=[upfile.id for upfile in upfiles])
+        for upload_layer_id, upfile_id, index in upload_layers.values_list('id', 'upload_file_id', 'index'):
+            if (upfile_id, index) in uncounted:
+                count_features.delay(upload_layer_id)
+
 
 class FileAddView(FormView, ImportHelper, JSONResponseMixin):
     form_class = UploadFileForm
@@ -138,7 +266,8 @@ class FileAddView(FormView, ImportHelper, JSONResponseMixin):
             path = paths[0]
             basename = os.path.basename(path)
             name = Truncator(basename).chars(max_length)
-            file_type = self.get_file_type(path)
+            # With ASYNC_INSPECTION, the file type is detected by the inspect_upload task.
+            file_type = None if ASYNC_INSPECTION else self.get_file_type(path)
         # Failing that, see if we can represent all the important paths within
         # the available space, making a meaningful mnemonic that isn't
         # misleading even though there isn't one obvious name. But if we can't
@@ -164,58 +293,32 @@ class FileAddView(FormView, ImportHelper, JSONResponseMixin):
         upload.save()
 
         # Create Upload Directory based on Upload PK
-        outpath = os.path.join('osgeo_importer_uploads', str(upload.pk))
-        outdir = os.path.join(FileSystemStorage().location, outpath)
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
+        outdir = self.get_upload_dir(upload)
 
-        # Move all files to uploads directory using upload pk
+        # Move all files to uploads directory using upload pk, files of zips are extracted straight into it
         # Must be done for all files before saving upfile for validation
         finalfiles = []
+        archives = set()
         for each in form.cleaned_data['file']:
+            if hasattr(each, 'extract'):
+                finalfiles.append(each.extract(outdir))
+                archives.add(each.archive)
+                continue
             tofile = os.path.join(outdir, os.path.basename(each.name))
             shutil.move(each.name, tofile)
             finalfiles.append(tofile)
 
-        # Loop through and create uploadfiles and uploadlayers
-        upfiles = []
-        for each in finalfiles:
-            upfile = UploadFile.objects.create(upload=upload)
-            upfiles.append(upfile)
-            upfile.file.name = each
-            # Detect and store file type for later reporting, since it is no
-            # longer true that every upload has only one file type.
-            try:
-                upfile.file_type = self.get_file_type(each)
-            except NoDataSourceFound:
-                upfile.file_type = None
-            upfile.save()
-            upfile_basename = os.path.basename(each)
-            _, upfile_ext = os.path.splitext(upfile_basename)
-            if upfile_ext.lower() not in ['.prj', '.dbf', '.shx']:
-                description = self.get_fields(each)
-                for layer in description:
-                    configuration_options = DEFAULT_LAYER_CONFIGURATION.copy()
-                    configuration_options.update({'index': layer.get('index')})
-                    layer_basename = os.path.basename(
-                        layer.get('layer_name') or ''
-                    )
-                    upload_layer = UploadLayer(
-                        upload_file=upfile,
-                        name=upfile_basename,
-                        layer_name=layer_basename,
-                        fields=layer.get('fields', {}),
-                        index=layer.get('index'),
-                        feature_count=layer.get('feature_count', None),
-                        configuration_options=configuration_options
-                    )
-                    upload.uploadlayer_set.add(upload_layer)
-        upload.size = sum(
-            upfile.file.size for upfile in upfiles
-        )
-        upload.complete = True
-        upload.state = 'UPLOADED'
-        upload.save()
+        for archive in archives:
+            os.remove(archive)
+
+        self.create_upload_files(upload, finalfiles, inspect=not ASYNC_INSPECTION)
+
+        if ASYNC_INSPECTION:
+            from .tasks import inspect_upload
+            inspect_upload.delay(upload.id)
+
+            if self.json:
+                return self.render_to_json_response({'state': upload.state, 'id': upload.id}, status=202)
 
         if self.json:
             return self.render_to_json_response({'state': upload.state, 'id': upload.id,
@@ -0,0 +1,448 @@
+import binascii
+import datetime
+import logging
+
+import gdal
+import ogr
+from django import db
+from django.conf import settings
+
+from .utils import datastore_connection_string, decode, quote_ident
+
+logger = logging.getLogger(__name__)
+ogr.UseExceptions()
+
+
+class OGRFeatureWriter(object):
+    """
+    Writers copy the features prepared by an importer into a target layer.
+
+    This writer uses OGR's CreateFeature, wrapping batches of features in transactions when the target layer
+    supports them.
+    """
+
+    def __init__(self, target_layer, layer_options=None, batch_size=1, converter=None, target_store=None):
+        self.target_layer = target_layer
+        self.target_store = target_store
+        self.layer_options = layer_options or {}
+        self.batch_size = batch_size
+        self.converter = converter
+        self.index_map = None
+
+    def get_index_map(self, feature):
+        """
+        Returns the index of each field of the source feature in the target layer (or -1), using the laundered
+        names in `modified_fields`.
+        """
+        modified_fields = self.layer_options.get('modified_fields', {})
+        target_definition = self.target_layer.GetLayerDefn()
+        index_map = []
+
+        for i in range(feature.GetFieldCount()):
+            name = feature.GetFieldDefnRef(i).GetName()
+            index_map.append(target_definition.GetFieldIndex(modified_fields.get(name, name)))
+
+        return index_map
+
+    def convert(self, feature):
+        """
+        Returns the feature to write to the target layer. Without a stream converter this is the source feature,
+        otherwise a feature of the target layer holding the source fields and the converted columns.
+        """
+        if self.converter is None:
+            return feature
+
+        if self.index_map is None:
+            self.index_map = self.get_index_map(feature)
+
+        target_feature = ogr.Feature(self.target_layer.GetLayerDefn())
+        target_feature.SetFromWithMap(feature, 1, self.index_map)
+        target_feature.SetFID(feature.GetFID())
+
+        for name, value in zip(self.converter.names, self.converter.values(feature)):
+            if value is None:
+                continue
+
+            if isinstance(value, datetime.datetime):
+                target_feature.SetField(name, value.year, value.month, value.day, value.hour, value.minute,
+                                        value.second, 0)
+            else:
+                target_feature.SetField(name, value)
+
+        return target_feature
+
+    def create_feature(self, feature, transaction=False):
+        """
+        Writes a single feature to the target layer, in its own transaction if `transaction` is True.
+
+        If the write fails, string fields that are not valid UTF-8 are decoded and the write is attempted once more.
+        """
+        fid = feature.GetFID()
+
+        try:
+            self.write_feature(feature, transaction)
+
+        except:
+            for field in range(0, feature.GetFieldCount()):
+                if feature.GetFieldType(field) == ogr.OFTString:
+                    try:
+                        feature.GetField(field).decode('utf8')
+                    except UnicodeDecodeError:
+                        feature.SetField(field, decode(feature.GetField(field)))
+                    except AttributeError:
+                        continue
+            try:
+                feature.SetFID(fid)
+                self.write_feature(feature, transaction)
+            except RuntimeError as e:
+                logger.error('Create feature failed: {0}'.format(gdal.GetLastErrorMsg()))
+                raise e
+
+    def write_feature(self, feature, transaction=False):
+        """
+        Writes a single feature, committing it in its own transaction (rolled back on failure) if `transaction` is
+        True.
+        """
+        if not transaction:
+            self.target_layer.CreateFeature(self.convert(feature))
+            return
+
+        self.target_layer.StartTransaction()
+
+        try:
+            self.target_layer.CreateFeature(self.convert(feature))
+            self.target_layer.CommitTransaction()
+        except RuntimeError:
+            self.rollback()
+            raise
+
+    def rollback(self):
+        """
+        Rolls back the current transaction, which may already be closed by a failed commit.
+        """
+        try:
+            self.target_layer.RollbackTransaction()
+        except RuntimeError:
+            pass
+
+    def write_features(self, batch):
+        """
+        Writes a batch of features one at a time, each in its own transaction.
+
+        :param batch: A list of (feature, fid) tuples, where fid is the FID the feature had before it was written.
+        """
+        for feature, fid in batch:
+            # A failed write may have assigned a FID to the feature, restore the original.
+            feature.SetFID(fid)
+            self.create_feature(feature, transaction=True)
+
+    def write_batch(self, batch):
+        """
+        Writes a batch of features to the target layer in a single transaction.
+
+        When the transaction fails it is rolled back and the batch is written again feature by feature, so a
+        single bad feature goes through the decode fallback in `create_feature` instead of failing the import.
+
+        New PostgreSQL tables are loaded with COPY, whose rows are only checked when the COPY ends as the
+        transaction is committed, so the commit is part of the attempt.
+
+        :param batch: A list of (feature, fid) tuples, where fid is the FID the feature had before it was written.
+        """
+        self.target_layer.StartTransaction()
+
+        try:
+            for feature, fid in batch:
+                self.target_layer.CreateFeature(self.convert(feature))
+
+            self.target_layer.CommitTransaction()
+        except RuntimeError:
+            self.rollback()
+            logger.debug('Batch of {0} features failed, retrying one feature at a time.'.format(len(batch)))
+            self.write_features(batch)
+
+    def can_batch(self):
+        """
+        Returns True if features should be written in batches.
+        """
+        return self.batch_size > 1 and self.target_layer.TestCapability(ogr.OLCTransactions)
+
+    def write(self, features):
+        """
+        Writes features to the target layer, in batches of `batch_size` features when possible.
+
+        :return: The number of features written.
+        """
+        count = 0
+
+        if not self.batch_size or not self.can_batch():
+            for feature in features:
+                self.create_feature(feature)
+                count += 1
+            self.finish()
+            return count
+
+        batch = []
+
+        for feature in features:
+            batch.append((feature, feature.GetFID()))
+
+            if len(batch) >= self.batch_size:
+                self.write_batch(batch)
+                count += len(batch)
+                batch = []
+
+        if batch:
+            self.write_batch(batch)
+            count += len(batch)
+
+        self.finish()
+        return count
+
+    def finish(self):
+        """
+        A hook called once all features have been written.
+        """
+        pass
+
+
+class CopyStream(object):
+    """
+    A read-only file-like object over an iterator of lines, used to stream rows into COPY ... FROM STDIN.
+    """
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self.buffer]
+        length = len(self.buffer)
+
+        while size < 0 or length < size:
+            try:
+                line = next(self.lines)
+            except StopIteration:
+                break
+            chunks.append(line)
+            length += len(line)
+
+        data = ''.join(chunks)
+
+        if size < 0:
+            self.buffer = ''
+            return data
+
+        self.buffer = data[size:]
+        return data[:size]
+
+    readline = read
+
+
+class PostGISCopyWriter(OGRFeatureWriter):
+    """
+    Streams features into a PostGIS table created by OGR using COPY ... FROM STDIN, with geometries sent as hex EWKB.
+
+    A batch that fails to COPY is written again through OGR one feature at a time, so bad features get the same
+    treatment they would with the OGRFeatureWriter.
+
+    COPY runs on the OSGEO_DATASTORE connection, so the target layer must be in that database.
+    """
+
+    NULL = '\\N'
+    COPY_ESCAPES = (('\\', '\\\\'), ('\t', '\\t'), ('\n', '\\n'), ('\r', '\\r'))
+
+    def __init__(self, *args, **kwargs):
+        super(PostGISCopyWriter, self).__init__(*args, **kwargs)
+
+        if self.target_store is not None and self.target_store != datastore_connection_string():
+            raise ValueError('The COPY writer only writes to the OSGEO_DATASTORE database.')
+
+        self.connection = db.connections[settings.OSGEO_DATASTORE]
+        self.fid_column = self.target_layer.GetFIDColumn()
+        self.geometry_column = self.target_layer.GetGeometryColumn()
+        self.table = self.target_layer.GetName()
+        self.srid = None
+        self.field_map = None
+        self.explicit_fids = False
+
+        # OGR defers the creation of new PostgreSQL tables until the first feature is written, make sure the table
+        # exists before it is written to from another connection.
+        self.target_layer.ResetReading()
+        self.target_layer.SyncToDisk()
+
+    def can_batch(self):
+        return self.batch_size > 1
+
+    def get_srid(self):
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT srid FROM geometry_columns WHERE f_table_name = %s AND f_geometry_column = %s',
+                       (self.table.split('.')[-1], self.geometry_column))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+    def get_field_map(self, feature):
+        """
+        Returns a list of (source field index, field type, target column) tuples for the fields of the source
+        feature that exist in the target layer, using the laundered names in `modified_fields`.
+        """
+        modified_fields = self.layer_options.get('modified_fields', {})
+        target_definition = self.target_layer.GetLayerDefn()
+        target_fields = [target_definition.GetFieldDefn(i).GetName() for i in range(target_definition.GetFieldCount())]
+        field_map = []
+
+        for i in range(feature.GetFieldCount()):
+            field_definition = feature.GetFieldDefnRef(i)
+            name = modified_fields.get(field_definition.GetName(), field_definition.GetName())
+
+            if name in target_fields and name != self.fid_column:
+                field_map.append((i, field_definition.GetType(), name))
+
+        return field_map
+
+    def escape(self, value):
+        if value is None:
+            return self.NULL
+
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+
+        for character, escaped in self.COPY_ESCAPES:
+            value = value.replace(character, escaped)
+
+        return value
+
+    @staticmethod
+    def format_datetime(feature, index, field_type):
+        year, month, day, hour, minute, second, tz = feature.GetFieldAsDateTime(index)
+
+        if field_type == ogr.OFTDate:
+            return '%04d-%02d-%02d' % (year, month, day)
+
+        value = '%02d:%02d:%06.3f' % (hour, minute, second)
+
+        if field_type == ogr.OFTTime:
+            return value
+
+        value = '%04d-%02d-%02d %s' % (year, month, day, value)
+
+        # OGR timezone flags: 100 is GMT, each step above or below is a 15 minute offset.
+        if tz > 1:
+            offset = (tz - 100) * 15
+            value += '%s%02d:%02d' % ('+' if offset >= 0 else '-', abs(offset) / 60, abs(offset) % 60)
+
+        return value
+
+    @staticmethod
+    def format_list(values):
+        items = []
+
+        for value in values:
+            if isinstance(value, basestring):
+                value = decode(value) if isinstance(value, str) else value
+                value = u'"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+            items.append(unicode(value))
+
+        return u'{{{0}}}'.format(u','.join(items))
+
+    def format_value(self, feature, index, field_type):
+        """
+        Returns the COPY text representation of a feature's field.
+        """
+        if not feature.IsFieldSet(index) or (hasattr(feature, 'IsFieldNull') and feature.IsFieldNull(index)):
+            return self.NULL
+
+        if field_type in (ogr.OFTDate, ogr.OFTTime, ogr.OFTDateTime):
+            value = self.format_datetime(feature, index, field_type)
+        elif field_type in (ogr.OFTIntegerList, ogr.OFTInteger64List, ogr.OFTRealList, ogr.OFTStringList):
+            value = self.format_list(feature.GetField(index))
+        elif field_type == ogr.OFTBinary:
+            value = '\\x' + feature.GetFieldAsBinary(index).encode('hex')
+        elif field_type == ogr.OFTString:
+            value = feature.GetField(index)
+            value = decode(value) if isinstance(value, str) else value
+        else:
+            value = feature.GetFieldAsString(index)
+
+        return self.escape(value)
+
+    def format_converted(self, value):
+        """
+        Returns the COPY text representation of a value computed by the stream converter.
+        """
+        if isinstance(value, datetime.datetime):
+            return value.isoformat(' ')
+
+        if isinstance(value, basestring):
+            return self.escape(value)
+
+        return self.NULL if value is None else str(value)
+
+    def format_geometry(self, feature):
+        geometry = feature.GetGeometryRef()
+
+        if geometry is None:
+            return self.NULL
+
+        return 'SRID={0};{1}'.format(self.srid, binascii.hexlify(geometry.ExportToIsoWkb()))
+
+    def rows(self, batch, include_fid):
+        for feature, fid in batch:
+            values = [self.format_geometry(feature)]
+
+            if include_fid:
+                values.append(str(feature.GetFID()))
+
+            values.extend(self.format_value(feature, index, field_type) for index, field_type, _ in self.field_map)
+
+            if self.converter is not None:
+                values.extend(self.format_converted(value) for value in self.converter.values(feature))
+
+            yield '\t'.join(values) + '\n'
+
+    def copy(self, batch, include_fid):
+        columns = [self.geometry_column]
+
+        if include_fid:
+            columns.append(self.fid_column)
+
+        columns.extend(name for _, _, name in self.field_map)
+
+        if self.converter is not None:
+            columns.extend(self.converter.names)
+
+        query = 'COPY {0} ({1}) FROM STDIN'.format(quote_ident(self.table),
+                                                   ', '.join(quote_ident(column) for column in columns))
+
+        with db.transaction.atomic(using=settings.OSGEO_DATASTORE):
+            cursor = self.connection.cursor()
+            cursor.copy_expert(query, CopyStream(self.rows(batch, include_fid)))
+
+    def write_batch(self, batch):
+        if self.field_map is None:
+            self.field_map = self.get_field_map(batch[0][0])
+            self.srid = self.get_srid()
+
+        fids = [feature.GetFID() != ogr.NullFID for feature, _ in batch]
+
+        # COPY can not mix rows that use the column default with rows that don't.
+        if any(fids) and not all(fids):
+            return self.write_features(batch)
+
+        try:
+            self.copy(batch, all(fids))
+        except (db.DatabaseError, UnicodeError):
+            logger.exception('COPY of {0} features failed, retrying one feature at a time.'.format(len(batch)))
+            return self.write_features(batch)
+
+        self.explicit_fids = self.explicit_fids or all(fids)
+
+    def finish(self):
+        """
+        Moves the FID sequence past any FIDs that were copied in explicitly.
+        """
+        if not self.explicit_fids:
+            return
+
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT setval(pg_get_serial_sequence(%s, %s), (SELECT max({1}) FROM {0}))'.format(
+            quote_ident(self.table), quote_ident(self.fid_column)), (self.table, self.fid_column))
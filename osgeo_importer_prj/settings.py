@@ -30,6 +30,7 @@ IMPORT_HANDLERS = [
     # If GeoServer handlers are enabled, you must have an instance of geoserver running.
     # Warning: the order of the handlers here matters.
     'osgeo_importer.handlers.FieldConverterHandler',
+    'osgeo_importer.handlers.IndexHandler',
     'osgeo_importer.handlers.geoserver.GeoserverPublishHandler',
     'osgeo_importer.handlers.geoserver.GeoserverPublishCoverageHandler',
     'osgeo_importer.handlers.geoserver.GeoServerTimeHandler',